@@ -13,6 +13,7 @@ Change Log  :
 from fastspider.http import Request, Response
 from fastspider.items import Field, Item, UniqueItem
 from fastspider.crawler import Crawler, CrawlerTask
+from fastspider.parser import cpu_bound
 
 __all__ = [
     "__version__",
@@ -23,6 +24,7 @@ __all__ = [
     "CrawlerTask",
     "Item",
     "Field",
+    "cpu_bound",
 ]
 
 __author__ = "lkkings"
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 抓取进度检查点
+@Date       : 2024/6/26 22:40
+@Author     : lkkings
+@FileName:  : checkpoint.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+检查点以追加写入的方式只记录两次刷新之间的增量:
+    ('task', task_id, do)   任务进入在途表
+    ('done', task_id)       任务完成
+    ('mark', cursor, stats) load_tasks 游标与监控计数
+日志记录数超过阈值时用当前在途任务重写, 重写的代价只与在途任务数有关
+"""
+import asyncio
+import os
+import pickle
+import struct
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from fastspider.core.runtime import Component
+from fastspider.logger import logger
+
+_HEADER = struct.Struct('<I')
+
+
+class CheckpointStore(ABC):
+    @abstractmethod
+    def append(self, records: List[Tuple]):
+        pass
+
+    @abstractmethod
+    def load(self) -> List[Tuple]:
+        pass
+
+    @abstractmethod
+    def rewrite(self, records: List[Tuple]):
+        pass
+
+
+class FileCheckpointStore(CheckpointStore):
+    """本地追加写入的快照文件 (Local append-only snapshot file)"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _encode(records: Iterable[Tuple]) -> bytes:
+        frames = []
+        for record in records:
+            data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+            frames.append(_HEADER.pack(len(data)))
+            frames.append(data)
+        return b''.join(frames)
+
+    def append(self, records: List[Tuple]):
+        with open(self.path, 'ab') as f:
+            f.write(self._encode(records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self) -> List[Tuple]:
+        if not self.path.exists():
+            return []
+        records = []
+        data = self.path.read_bytes()
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            (size,) = _HEADER.unpack_from(data, offset)
+            offset += _HEADER.size
+            if offset + size > len(data):
+                # 进程崩溃时写了一半的记录, 直接丢弃
+                logger.warning(f'检查点 {self.path} 末尾记录不完整, 已忽略')
+                break
+            records.append(pickle.loads(data[offset:offset + size]))
+            offset += size
+        return records
+
+    def rewrite(self, records: List[Tuple]):
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(self._encode(records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class RedisCheckpointStore(CheckpointStore):
+    """保存在 Redis 列表中的快照 (Snapshot kept in a Redis list)"""
+
+    def __init__(self, redis_conn, name: str):
+        self.redis_conn = redis_conn
+        self.name = name
+
+    def append(self, records: List[Tuple]):
+        if records:
+            self.redis_conn.rpush(self.name, *[pickle.dumps(record) for record in records])
+
+    def load(self) -> List[Tuple]:
+        return [pickle.loads(data) for data in self.redis_conn.lrange(self.name, 0, -1)]
+
+    def rewrite(self, records: List[Tuple]):
+        pipe = self.redis_conn.pipeline(transaction=True)
+        pipe.delete(self.name)
+        if records:
+            pipe.rpush(self.name, *[pickle.dumps(record) for record in records])
+        pipe.execute()
+
+
+@dataclass
+class CheckpointState:
+    cursor: int = 0
+    tasks: Dict[int, Any] = field(default_factory=dict)
+    stats: Dict = field(default_factory=dict)
+
+
+class Checkpoint(Component):
+    """
+    周期性保存抓取进度 (Periodically persists the crawl frontier)
+
+    Args:
+        store: CheckpointStore: 存储后端
+        live_tasks: Callable: 返回当前在途任务 {task_id: do}, 用于重写日志
+        stats: Callable: 返回监控计数快照
+    """
+
+    def __init__(self, cfg: Dict, store: CheckpointStore,
+                 live_tasks: Callable[[], Dict[int, Any]], stats: Callable[[], Dict]):
+        cfg = cfg.get('checkpoint', {})
+        self.interval: float = cfg.get('interval', 10)
+        self.compact_threshold: int = cfg.get('compact', 100000)
+        self.store = store
+        self.cursor = 0
+        self._live_tasks = live_tasks
+        self._stats = stats
+        self._records: List[Tuple] = []
+        self._log_size = 0
+        self._running = False
+        self._stop_event = asyncio.Event()
+
+    def record_task(self, task_id: int, do: Any):
+        self._records.append(('task', task_id, do))
+
+    def record_done(self, task_id: int):
+        self._records.append(('done', task_id))
+
+    def restore(self) -> CheckpointState:
+        """回放日志得到上次的进度 (Replay the log to rebuild the last state)"""
+        state = CheckpointState()
+        records = self.store.load()
+        for record in records:
+            kind = record[0]
+            if kind == 'task':
+                state.tasks[record[1]] = record[2]
+            elif kind == 'done':
+                state.tasks.pop(record[1], None)
+            elif kind == 'mark':
+                state.cursor, state.stats = record[1], record[2]
+        # 恢复后重写一次日志, 去掉已完成的任务以及崩溃时残留的不完整记录
+        live = [('mark', state.cursor, state.stats)]
+        live.extend(('task', task_id, do) for task_id, do in state.tasks.items())
+        self.store.rewrite(live)
+        self._log_size = len(live)
+        self.cursor = state.cursor
+        logger.info(f'从检查点恢复：游标 {state.cursor}, 在途任务 {len(state.tasks)}')
+        return state
+
+    async def flush(self):
+        records, self._records = self._records, []
+        records.append(('mark', self.cursor, self._stats()))
+        loop = asyncio.get_running_loop()
+        try:
+            if self._log_size + len(records) > self.compact_threshold:
+                # 在事件循环中取在途任务快照, 避免在线程中遍历正在变化的字典
+                live = [records[-1]]
+                live.extend(('task', task_id, do) for task_id, do in self._live_tasks().items())
+                await loop.run_in_executor(None, self.store.rewrite, live)
+                self._log_size = len(live)
+            else:
+                await loop.run_in_executor(None, self.store.append, records)
+                self._log_size += len(records)
+        except Exception as e:
+            # 写入失败时保留增量, 下次一并写入
+            self._records = records[:-1] + self._records
+            logger.error(f'检查点保存失败：{e}')
+
+    async def run(self):
+        self._running = True
+        self._stop_event.clear()
+        while self._running:
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), self.interval)
+                break
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def stop(self):
+        # 立即唤醒主循环, 最后一次写入由 teardown 完成
+        self._running = False
+        self._stop_event.set()
+
+    async def teardown(self):
+        await self.flush()
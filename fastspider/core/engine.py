@@ -11,13 +11,18 @@ Change Log  :
 
 """
 import asyncio
+import json
+import os
 import pickle
-from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
 
 import aiohttp
 
 from fastspider import Request
 from fastspider.items import Item, UniqueItem
+from fastspider.core.checkpoint import Checkpoint, FileCheckpointStore, RedisCheckpointStore
+from fastspider.core.runtime import Runtime
+from fastspider.core.shard import Shard, ShardRunner
 from fastspider.crawler import Crawler, CrawlerTask
 from fastspider.downloader import Downloader
 from fastspider.config import ConfigManager
@@ -25,9 +30,13 @@ from fastspider.exceptions import ClassTypeError
 from fastspider.logger import logger
 from fastspider.middleware import RedisManager
 from fastspider.monitor import Monitor
+from fastspider.parser import Parser
+from fastspider.scheduler.dupefilter import TieredFilter
 from fastspider.storage import get_storage
 from fastspider.utils._signal import SignalManager
+from fastspider.utils.bloom_filter import AsyncBloomFilter
 from fastspider.utils.common import false_empty_afunc
+from fastspider.utils.file_utils import AsyncFileList
 from fastspider.utils.reflection_utils import get_method_return_type
 
 
@@ -42,22 +51,139 @@ class Spider:
 
         self.__running: bool = False
 
+        self._loop = None
+        self._monitor = Monitor()
+        self._filter = None
+        self._storage = None
+        self._downloader = None
+        self._crawler = None
+        self._parser = None
+        self._runtime = None
+        self._checkpoint = None
+        self._resume = False
+        # 分片模式下当前进程负责的分片 (Shard owned by this process in sharded mode)
+        self._shard = None
+
+        self._Item = None
+        self._CrawlerTask = None
+
+        # 仅保存在途任务, 任务结束后移出, 只在监控中保留计数
+        self._crawler_tasks = {}
+        self._inflight = None
+        self._max_inflight = cfg.get('max_inflight', 10000)
+        # 因主机熔断暂存、不占在途名额的任务数, 以及等待名额重新进入的任务
+        self._parked = 0
+        self._readmits = set()
+        self._sent = False
+        # 多节点共享的 Redis 任务队列, 以及待批量确认的租约
+        self._frontier = None
+        self._acks = []
+        self._dead_letter = None
+        # 尚未完成的 Redis 写入, 关闭连接池前等待
+        self._writes = set()
+
+    def _setup(self):
+        """
+        创建事件循环与各组件 (Create the event loop and components)
+
+        组件在启动时才创建, 分片模式下每个子进程拥有自己的事件循环与连接
+        """
+        cfg = self.__cfg
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
         self._loop = loop
 
-        self._monitor = Monitor()
-        self._filter = RedisManager(cfg).create_bloom_filter(f'{self.name}.down_item',
-                                                             capacity=cfg['bloom_size'])
+        self._filter = self._create_filter(cfg.get('bloom', {}))
+        local_cfg = cfg.get('bloom', {}).get('local', {})
+        if local_cfg.get('enable'):
+            self._filter = TieredFilter(self._filter, local_cfg, ttl=getattr(self._filter, 'interval', None))
         self._storage = get_storage(cfg)
         self._downloader = Downloader(cfg, loop=loop)
         self._crawler = Crawler(cfg, loop=loop)
-
-        self._Item = None
-        self._CrawlerTask = None
-
-        self._crawler_tasks = {}
+        self._parser = Parser(cfg, loop=loop)
+        self._crawler.register_fetched_callback(self._settle)
+        self._crawler.on_park = self._park
+        self._crawler.on_unpark = self._unpark
+        self._inflight = asyncio.Semaphore(self._max_inflight)
+        # 重试次数用尽的任务写入死信列表, 便于排查后重新投递
+        self._dead_letter = self._create_dead_letter(cfg.get('dead_letter', {}))
+        frontier_cfg = cfg.get('frontier', {})
+        if frontier_cfg.get('enable'):
+            self._frontier = RedisManager(cfg).create_frontier(
+                f'{self.name}.frontier', visibility_timeout=frontier_cfg.get('visibility_timeout', 300))
+        if cfg.get('crawler', {}).get('fingerprint', {}).get('spill'):
+            self._crawler.dupefilter.spill = RedisManager(cfg).create_async_set(f'{self.name}.fingerprints')
+
+        # 启动顺序: 存储 -> 监控 -> 下载器 -> 爬虫, 停止时逆序, 保证下游先于上游就绪、晚于上游退出
+        self._runtime = Runtime(cfg)
+        self._runtime.add(self._storage)
+        self._runtime.add(self._monitor)
+        self._runtime.add(self._downloader)
+        self._runtime.add(self._crawler.delay_queue)
+        self._runtime.add(self._crawler)
+
+        checkpoint_cfg = cfg.get('checkpoint', {})
+        if checkpoint_cfg.get('enable') or self._resume:
+            self._checkpoint = Checkpoint(cfg, self._create_checkpoint_store(checkpoint_cfg),
+                                          live_tasks=lambda: {k: t.do for k, t in self._crawler_tasks.items()},
+                                          stats=self._monitor.snapshot)
+            self._runtime.add(self._checkpoint)
+
+        self._monitor.register_gauge('任务队列', self._crawler.task_queue.stats)
+        self._monitor.register_gauge('解析队列', self._crawler.down_queue.stats)
+        self._monitor.register_gauge('存储缓冲', self._storage.stats)
+        self._monitor.register_gauge('延迟重试', self._crawler.delay_queue.stats)
+        self._monitor.register_gauge('任务状态', self._crawler.registry.counts)
+        self._monitor.register_gauge('抓取并发', self._crawler.limiter.stats)
+        self._monitor.register_gauge('熔断主机', self._crawler.breaker.stats)
+        if self._crawler.dupefilter.enable:
+            self._monitor.register_gauge('请求去重', self._crawler.dupefilter.stats)
+        if hasattr(self._filter, 'stats'):
+            self._monitor.register_gauge('结果去重', self._filter.stats)
+        if self._crawler.hedger.enable:
+            self._monitor.register_gauge('对冲请求', self._crawler.hedger.stats)
+        if self._crawler.coalescer.enable:
+            self._monitor.register_gauge('合并请求', self._crawler.coalescer.stats)
+        self._monitor.register_gauge('下载并发', self._downloader.limiter.stats)
+
+    def _create_filter(self, cfg: Dict):
+        capacity = self.__cfg['bloom_size']
+        error_rate = cfg.get('error_rate', 0.001)
+        if cfg.get('backend', 'redis') == 'local':
+            suffix = f'.shard{self._shard.index}' if self._shard else ''
+            path = cfg.get('path')
+            if path:
+                os.makedirs(path, exist_ok=True)
+                path = os.path.join(path, f'{self.name}{suffix}.bloom')
+            return AsyncBloomFilter(capacity, error_rate, path)
+        recrawl_cfg = cfg.get('recrawl', {})
+        if recrawl_cfg.get('enable'):
+            return RedisManager(self.__cfg).create_async_cuckoo_filter(
+                f'{self.name}.down_item', capacity=capacity, interval=recrawl_cfg.get('interval', 86400),
+                generations=recrawl_cfg.get('generations', 4))
+        if cfg.get('scalable'):
+            return RedisManager(self.__cfg).create_async_scalable_bloom_filter(
+                f'{self.name}.down_item', capacity=capacity, error_rate=error_rate,
+                growth=cfg.get('growth', 2), tightening=cfg.get('tightening', 0.5),
+                fill_ratio=cfg.get('fill_ratio', 1.0))
+        return RedisManager(self.__cfg).create_async_bloom_filter(f'{self.name}.down_item', capacity=capacity,
+                                                                  error_rate=error_rate)
+
+    def _create_dead_letter(self, cfg: Dict):
+        """死信列表默认与 bloom.backend 一致, 未部署 Redis 时写入本地文件 (Follows bloom.backend unless set)"""
+        backend = cfg.get('backend') or self.__cfg.get('bloom', {}).get('backend', 'redis')
+        if backend == 'local':
+            suffix = f'.shard{self._shard.index}' if self._shard else ''
+            return AsyncFileList(os.path.join(cfg.get('path', './dead_letter'), f'{self.name}{suffix}.jsonl'))
+        return RedisManager(self.__cfg).create_async_list(f'{self.name}.dead_letter')
+
+    def _create_checkpoint_store(self, cfg: Dict):
+        suffix = f'.shard{self._shard.index}' if self._shard else ''
+        if cfg.get('backend', 'file') == 'redis':
+            return RedisCheckpointStore(RedisManager(self.__cfg).redis_conn, f'{self.name}.checkpoint{suffix}')
+        path = os.path.join(cfg.get('path', './checkpoint'), f'{self.name}{suffix}.ckpt')
+        return FileCheckpointStore(path)
 
     @property
     def monitor(self) -> Monitor:
@@ -86,62 +212,272 @@ class Spider:
 
         return decorator
 
+    async def _store(self, crawler_task: CrawlerTask, items: List[Item]):
+        items = [item for item in items if item]
+        if not items:
+            return
+        duplicated = await crawler_task.dedup_many(items, self._filter)
+        await self._storage.add_many(item for item, duplicate in zip(items, duplicated) if not duplicate)
+
+    def _parsed(self, crawler_task: CrawlerTask):
+        crawler_task.pending -= 1
+        self._settle(crawler_task)
+
+    def _settle(self, crawler_task: CrawlerTask):
+        """任务抓取结束且页面全部解析后, 失败的任务重新入队, 成功与取消的任务移出在途表"""
+        if not crawler_task.fetched or crawler_task.pending > 0:
+            return
+        if crawler_task.cancelled:
+            self._finish(crawler_task, success=False, cancelled=True)
+            return
+        if crawler_task.failed:
+            crawler_task.failed = False
+            if crawler_task.attempts < self._crawler.retry_budget:
+                crawler_task.fetched = False
+                self._crawler.retry_task(crawler_task)
+                return
+            self._bury(crawler_task)
+            self._finish(crawler_task, success=False)
+            return
+        self._finish(crawler_task)
+
+    def _park(self, crawler_task: CrawlerTask):
+        """熔断主机的任务暂存期间归还在途名额, 健康主机的任务可以立即进入 (Parked tasks give back their slot)"""
+        self._parked += 1
+        self._inflight.release()
+
+    def _unpark(self, crawler_task: CrawlerTask):
+        readmit = self._loop.create_task(self._readmit(crawler_task))
+        self._readmits.add(readmit)
+        readmit.add_done_callback(self._readmits.discard)
+
+    async def _readmit(self, crawler_task: CrawlerTask):
+        """主机恢复后, 暂存的任务重新取得在途名额再入队 (Re-take a slot before the released task is queued)"""
+        await self._inflight.acquire()
+        self._parked -= 1
+        self._crawler.put_task_nowait(crawler_task)
+
+    def _bury(self, crawler_task: CrawlerTask):
+        """重试次数用尽的任务写入死信列表 (Send an exhausted task to the dead-letter list)"""
+        logger.error(f'任务 {crawler_task.task_id} 重试{crawler_task.attempts}次后仍失败, 已写入死信列表')
+        record = json.dumps({
+            'task_id': crawler_task.task_id,
+            'do': str(crawler_task.do),
+            'attempts': crawler_task.attempts,
+            'error': str(crawler_task.error),
+        }, ensure_ascii=False)
+        write = self._loop.create_task(self._dead_letter.append(record))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+        write.add_done_callback(lambda f: f.exception() and logger.error(f'写入死信列表失败：{f.exception()}'))
+
+    def _finish(self, crawler_task: CrawlerTask, success: bool = True, cancelled: bool = False):
+        if self._crawler_tasks.pop(crawler_task.task_id, None) is None:
+            return
+        self._monitor.finish_task(success, cancelled)
+        if self._checkpoint:
+            self._checkpoint.record_done(crawler_task.task_id)
+        if crawler_task.lease:
+            self._acks.append(crawler_task.lease)
+        self._inflight.release()
+        self._check_done()
+
+    def _check_done(self):
+        if self._sent and not self._crawler_tasks:
+            self._crawler.finish()
+
     async def _rev(self):
-        with ThreadPoolExecutor(max_workers=self._crawler.parse_thread_num) as executor:
-            while self._crawler.running:
-                crawler_task, text = await self._crawler.down_queue.get()
-                crawler_task: CrawlerTask
-                if not crawler_task:
-                    logger.info('任务全部完成')
-                    continue
-                if crawler_task.success:
-                    self._monitor.update(success=True)
-                    executor.submit(crawler_task.parse, text)
-                else:
-                    self._monitor.update(success=False)
-                    await self._crawler.put_task(crawler_task)
+        while True:
+            crawler_task, text = await self._crawler.down_queue.get()
+            crawler_task: CrawlerTask
+            if not crawler_task:
+                logger.info('任务全部完成')
+                break
+            if text is not None:
+                self._monitor.update(success=True)
+                await self._parser.submit(crawler_task, text, self._store, done=self._parsed)
+            else:
+                self._monitor.update(success=False)
+                crawler_task.failed = True
+                self._parsed(crawler_task)
+        await self._parser.join()
+
+    async def _admit(self, task_id: int, task, lease: str = None, dedup: bool = True):
+        await self._inflight.acquire()
+        crawler_task: CrawlerTask = self._CrawlerTask()
+        crawler_task.task_id = task_id
+        crawler_task.do = task
+        crawler_task.lease = lease
+        self._crawler_tasks[task_id] = crawler_task
+        self._monitor.n += 1
+        if self._checkpoint:
+            self._checkpoint.record_task(task_id, task)
+            # 任务写入检查点后才推进游标, 否则等待在途名额期间崩溃会跳过该任务; 恢复的任务不会回退游标
+            self._checkpoint.cursor = max(self._checkpoint.cursor, task_id)
+        await self._crawler.put_task(crawler_task, dedup=dedup)
 
     async def _send(self):
+        """按需从 load_tasks 拉取任务, 在途任务数达到上限时挂起 (Lazily pulls tasks, bounded by max_inflight)"""
         task_id = 0
+        cursor = 0
+        if self._resume:
+            state = self._checkpoint.restore()
+            cursor = state.cursor
+            if state.stats:
+                self._monitor.merge([state.stats])
+            # 上次未完成的任务重新计入在途表, 计数已包含在恢复的统计中
+            self._monitor.n -= len(state.tasks)
+            for _task_id, task in state.tasks.items():
+                await self._admit(_task_id, task, dedup=False)
         async for task in self._CrawlerTask.load_tasks():
             if SignalManager.is_shutdown_signaled():
                 break
             task_id += 1
-            crawler_task: CrawlerTask = self._CrawlerTask()
-            crawler_task.task_id = task_id
-            crawler_task.do = task
-            await self._crawler.put_task(crawler_task)
-            self._crawler_tasks[task_id] = crawler_task
+            if task_id <= cursor:
+                continue
+            if self._shard and not self._shard.owns(task):
+                # 其他分片的任务不需要记录, 直接推进游标
+                if self._checkpoint:
+                    self._checkpoint.cursor = task_id
+                continue
+            await self._admit(task_id, task)
+        self._sent = True
         await self._crawler.put_task(None)
+        self._check_done()
+
+    async def _flush_acks(self):
+        acks, self._acks = self._acks, []
+        if acks:
+            await self._loop.run_in_executor(None, self._frontier.ack_many, acks)
+
+    async def _heartbeat(self):
+        """
+        定期为在途任务的租约续期, 处理时间超过 visibility_timeout 的任务不会被其他节点接手
+        (Keep the frontier leases of in-flight tasks alive)
+        """
+        interval = self.__cfg.get('frontier', {}).get('heartbeat') or self._frontier.visibility_timeout / 3
+        while True:
+            await asyncio.sleep(interval)
+            leases = [task.lease for task in self._crawler_tasks.values() if task.lease]
+            if not leases:
+                continue
+            try:
+                extended = await self._loop.run_in_executor(None, self._frontier.extend_many, leases)
+            except Exception as e:
+                logger.error(f'租约续期失败：{e}')
+                continue
+            if extended < len(leases):
+                logger.warning(f'{len(leases) - extended}个任务的租约已超时, 可能被其他节点重复处理')
+
+    async def _send_frontier(self):
+        """
+        从多节点共享的 Redis 任务队列批量租用任务 (Lease tasks in batches from the shared Redis frontier)
+
+        配置 frontier.seed 的节点负责把 load_tasks 批量写入队列, 所有节点都从队列租用任务,
+        完成的任务批量确认, 未确认的任务在租约超时后由其他节点接手
+        """
+        cfg = self.__cfg.get('frontier', {})
+        batch = cfg.get('batch', 500)
+        if cfg.get('seed'):
+            buffer = []
+            async for task in self._CrawlerTask.load_tasks():
+                if SignalManager.is_shutdown_signaled():
+                    break
+                buffer.append(task)
+                if len(buffer) >= batch:
+                    await self._loop.run_in_executor(None, self._frontier.push_many, buffer)
+                    buffer = []
+            await self._loop.run_in_executor(None, self._frontier.push_many, buffer)
+        task_id = 0
+        while not SignalManager.is_shutdown_signaled():
+            await self._flush_acks()
+            free = min(batch, self._max_inflight - len(self._crawler_tasks) + self._parked)
+            leased = await self._loop.run_in_executor(None, self._frontier.lease, free) if free > 0 else []
+            if not leased:
+                if not self._crawler_tasks and await self._loop.run_in_executor(None, self._frontier.is_empty):
+                    break
+                await asyncio.sleep(1)
+                continue
+            for lease, task in leased:
+                task_id += 1
+                # 租约超时后重新投递的任务不能按指纹丢弃, 否则会被确认而没有抓取
+                await self._admit(task_id, task, lease=lease, dedup=False)
+        await self._flush_acks()
+        self._sent = True
+        await self._crawler.put_task(None)
+        self._check_done()
 
     async def _work(self):
-        send_task = asyncio.create_task(self._send())
-        rev_task = asyncio.create_task(self._rev())
-        await asyncio.gather(send_task, rev_task)
+        await self._runtime.start()
+        try:
+            send_task = asyncio.create_task(self._send_frontier() if self._frontier else self._send())
+            rev_task = asyncio.create_task(self._rev())
+            heartbeat = asyncio.create_task(self._heartbeat()) if self._frontier else None
+            try:
+                await asyncio.gather(send_task, rev_task)
+            finally:
+                if heartbeat:
+                    heartbeat.cancel()
+        finally:
+            for readmit in list(self._readmits):
+                readmit.cancel()
+            await self._runtime.stop()
+            if self._writes:
+                await asyncio.gather(*self._writes, return_exceptions=True)
+            if isinstance(self._filter, TieredFilter):
+                await self._filter.close()
+            elif isinstance(self._filter, AsyncBloomFilter):
+                self._filter.close()
+            await RedisManager(self.__cfg).aclose()
 
     def _before_run_check_(self):
         assert self._Item is not None, '未检测出Item'
         assert self._CrawlerTask is not None, '未检测出CrawlerTask'
         if not issubclass(self._Item, UniqueItem):
             self._CrawlerTask.dedup = false_empty_afunc
+        self._CrawlerTask.check_dedup()
         request_method = getattr(self._CrawlerTask, 'request')
         return_type = get_method_return_type(request_method)
         assert issubclass(return_type, Request), f'{self._CrawlerTask.__name__} request方法应该返回Request类型'
 
-    def start(self):
+    def start(self, workers: int = None, resume: bool = False):
+        """
+        启动爬虫 (Start the spider)
+
+        Args:
+            workers: int: 分片进程数, 大于1时以多进程分片模式运行, 默认读取配置 workers
+            resume: bool: 从检查点恢复上次的抓取进度
+        """
         if self.__running:
             raise RuntimeError("引擎已经处于运行状态！")
         self._before_run_check_()
+        self._resume = resume
+        workers = workers or self.__cfg.get('workers', 1)
+        if workers > 1 and self._shard is None:
+            ShardRunner(self, workers).run()
+            return
         self.__running = True
+        self._setup()
         signal = SignalManager()
         signal.register_shutdown_signal()
-        self._storage.start()
-        self._monitor.start()
-        self._crawler.start()
-        self._downloader.start()
+        signal.register_shutdown_callback(self._storage.stop)
         self._loop.run_until_complete(self._work())
 
+    def _run_shard(self, shard: Shard, channel):
+        """分片子进程入口 (Entry of a shard worker process)"""
+        self._shard = shard
+        self._monitor.set_reporter(lambda snapshot: channel.put((shard.index, snapshot)))
+        try:
+            self.start(resume=self._resume)
+        finally:
+            self._monitor.stop()
+            if self._storage:
+                self._storage.stop()
+            channel.put((shard.index, self._monitor.snapshot()))
+
     def stop(self):
+        if self._parser:
+            self._parser.shutdown()
         if self._storage:
             self._storage.stop()
         if self._monitor:
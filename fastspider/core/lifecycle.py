@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 任务生命周期登记表
+@Date       : 2024/6/30 09:40
+@Author     : lkkings
+@FileName:  : lifecycle.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+状态流转:
+    queued -> running -> done / failed
+    queued -> paused -> queued
+    cancelled -> queued (仅用户重新添加, 内部回流的已取消任务直接丢弃)
+    queued / paused / running -> cancelled
+    running -> cancelled (外部取消, finish(cancelled=True))
+终态(done/failed)只计数不保留任务, 登记表的内存只与在途任务数有关
+"""
+import asyncio
+from collections import Counter
+from enum import Enum
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set
+
+
+class TaskState(str, Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    CANCELLED = 'cancelled'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+# 保留任务对象的状态 (States whose tasks are kept in the registry)
+LIVE_STATES = (TaskState.QUEUED, TaskState.RUNNING, TaskState.PAUSED, TaskState.CANCELLED)
+
+
+class TaskRegistry:
+    """
+    按状态分桶的任务登记表, 状态流转与查询均为 O(1)
+    (Task registry bucketed by state with O(1) transitions and lookups)
+
+    已取消但仍在队列中的任务保留在 cancelled 桶中, 出队时由 skip 丢弃。
+    on_drop 在任务未执行就被丢弃时调用, 供调用方结算该任务
+
+    Args:
+        on_drop: Callable: 任务被丢弃时的回调, 参数为任务对象
+    """
+
+    def __init__(self, on_drop: Callable[[Any], None] = None):
+        self.on_drop = on_drop
+        self._states: Dict[Hashable, TaskState] = {}
+        self._buckets: Dict[TaskState, Dict[Hashable, Any]] = {state: {} for state in LIVE_STATES}
+        self._handles: Dict[Hashable, asyncio.Task] = {}
+        # 已出队的暂停任务, 恢复时需要重新入队
+        self._parked: Set[Hashable] = set()
+        self._finished = Counter()
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, key: Hashable):
+        return key in self._states
+
+    def state(self, key: Hashable) -> Optional[TaskState]:
+        return self._states.get(key)
+
+    def get(self, key: Hashable) -> Any:
+        state = self._states.get(key)
+        return None if state is None else self._buckets[state].get(key)
+
+    def _move(self, key: Hashable, state: TaskState, task: Any = None):
+        old = self._states.get(key)
+        if old is not None:
+            old_task = self._buckets[old].pop(key)
+            task = old_task if task is None else task
+        if state in LIVE_STATES:
+            self._states[key] = state
+            self._buckets[state][key] = task
+        else:
+            self._states.pop(key, None)
+            self._finished[state] += 1
+
+    def queue(self, key: Hashable, task: Any):
+        """任务入队, 已取消的任务由用户重新添加时恢复 (An explicit re-add revives a cancelled task)"""
+        self._move(key, TaskState.QUEUED, task)
+
+    def requeue(self, key: Hashable, task: Any) -> bool:
+        """
+        内部回流(延迟重试、熔断恢复)的任务重新入队, 期间已被取消的任务不恢复, 经 on_drop 结算并返回 False
+        (Internal re-queue; a task cancelled while delayed or parked is dropped instead of revived)
+        """
+        if self._states.get(key) == TaskState.CANCELLED:
+            self._drop(key, TaskState.CANCELLED)
+            return False
+        self._move(key, TaskState.QUEUED, task)
+        return True
+
+    def start(self, key: Hashable, handle: asyncio.Task = None):
+        self._move(key, TaskState.RUNNING)
+        if handle is not None:
+            self._handles[key] = handle
+
+    def finish(self, key: Hashable, failed: bool = False, cancelled: bool = False):
+        """
+        任务结束, 经 cancel 取消的任务只移除不计数; cancelled 表示任务被外部取消(如停止时), 计入取消数
+        (A task cancelled through cancel was counted already; `cancelled` counts an external cancellation)
+        """
+        self._handles.pop(key, None)
+        state = self._states.get(key)
+        if state is None:
+            return
+        if state == TaskState.CANCELLED or cancelled:
+            self._buckets[state].pop(key)
+            del self._states[key]
+            if state != TaskState.CANCELLED:
+                self._finished[TaskState.CANCELLED] += 1
+            return
+        self._move(key, TaskState.FAILED if failed else TaskState.DONE)
+
+    def _drop(self, key: Hashable, state: TaskState):
+        task = self._buckets[state].pop(key)
+        del self._states[key]
+        if self.on_drop and task is not None:
+            self.on_drop(task)
+
+    def skip(self, key: Hashable) -> bool:
+        """
+        出队时检查任务是否应跳过, 已取消的任务在此移出登记表, 暂停的任务留待 resume
+        (Whether a dequeued task should be skipped)
+        """
+        state = self._states.get(key)
+        if state == TaskState.CANCELLED:
+            self._drop(key, state)
+            return True
+        if state == TaskState.PAUSED:
+            self._parked.add(key)
+            return True
+        return False
+
+    def pause(self, key: Hashable) -> bool:
+        """暂停排队中的任务 (Pause a queued task)"""
+        if self._states.get(key) != TaskState.QUEUED:
+            return False
+        self._move(key, TaskState.PAUSED)
+        return True
+
+    def resume(self, key: Hashable) -> Any:
+        """
+        恢复暂停的任务, 任务已出队时返回任务对象由调用方重新入队, 仍在队列中时返回 None
+        (Returns the task when it has left the queue and must be re-queued by the caller)
+        """
+        if self._states.get(key) != TaskState.PAUSED:
+            return None
+        task = self._buckets[TaskState.PAUSED][key]
+        self._move(key, TaskState.QUEUED)
+        if key in self._parked:
+            self._parked.discard(key)
+            return task
+        return None
+
+    def cancel(self, key: Hashable, task: Any = None) -> bool:
+        """
+        取消任务: 运行中的任务立即取消, 排队中的任务出队时丢弃;
+        未登记的任务也会记为取消, 之后入队时才会恢复
+
+        Args:
+            key: 任务键
+            task: 未登记时保存的任务对象
+        """
+        if self._states.get(key) == TaskState.CANCELLED:
+            return False
+        handle = self._handles.pop(key, None)
+        if key in self._parked:
+            # 已出队的暂停任务不会再经过 skip, 直接移出
+            self._parked.discard(key)
+            self._drop(key, TaskState.PAUSED)
+            self._finished[TaskState.CANCELLED] += 1
+            return True
+        self._move(key, TaskState.CANCELLED, task)
+        self._finished[TaskState.CANCELLED] += 1
+        if handle is not None:
+            handle.cancel()
+        return True
+
+    def select(self, predicate: Callable[[Any], bool] = None, state: TaskState = None) -> List[Any]:
+        """按状态与条件列出任务 (List tasks by state and predicate)"""
+        states = (state,) if state else LIVE_STATES
+        return [task for s in states for task in self._buckets[s].values()
+                if predicate is None or predicate(task)]
+
+    def cancel_where(self, predicate: Callable[[Any], bool], state: TaskState = None) -> int:
+        """批量取消满足条件的任务, 返回取消数量 (Cancel matching tasks in bulk)"""
+        states = (state,) if state else (TaskState.QUEUED, TaskState.RUNNING, TaskState.PAUSED)
+        keys = [key for s in states for key, task in self._buckets[s].items() if predicate(task)]
+        for key in keys:
+            self.cancel(key)
+        return len(keys)
+
+    def counts(self) -> Dict[str, int]:
+        counts = {state.value: len(self._buckets[state]) for state in LIVE_STATES}
+        # 取消数为累计值, 包括已出队丢弃的任务
+        counts[TaskState.CANCELLED.value] = self._finished[TaskState.CANCELLED]
+        counts[TaskState.DONE.value] = self._finished[TaskState.DONE]
+        counts[TaskState.FAILED.value] = self._finished[TaskState.FAILED]
+        return counts
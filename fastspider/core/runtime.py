@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 组件运行时
+@Date       : 2024/6/25 20:15
+@Author     : lkkings
+@FileName:  : runtime.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from fastspider.logger import logger
+
+
+class Component(ABC):
+    """
+    运行在事件循环上的组件 (A component running as a task on the event loop)
+
+    生命周期: setup -> run -> stop -> teardown, run 抛出异常时由 Runtime 负责重启
+    """
+
+    @property
+    def name(self) -> str:
+        return self.__class__.__name__
+
+    async def setup(self):
+        """创建组件依赖的资源, 例如连接 (Acquire resources such as connections)"""
+
+    @abstractmethod
+    async def run(self):
+        """组件主循环, 正常返回表示组件工作完成 (Main loop, returning means the component is done)"""
+
+    def stop(self):
+        """通知主循环退出 (Ask the main loop to exit)"""
+
+    async def teardown(self):
+        """释放资源 (Release resources)"""
+
+
+class Runtime:
+    """
+    在同一个事件循环上按顺序启动、监督并逆序停止组件
+    (Starts components in order on one loop, supervises them and stops them in reverse order)
+    """
+
+    def __init__(self, cfg: Dict = None):
+        cfg = (cfg or {}).get('runtime', {})
+        self.max_restarts: int = cfg.get('max_restarts', 3)
+        self.restart_delay: float = cfg.get('restart_delay', 1)
+        self.stop_timeout: float = cfg.get('stop_timeout', 5)
+        self._components: List[Component] = []
+        self._tasks: Dict[Component, asyncio.Task] = {}
+        self._restarts: Dict[Component, int] = {}
+
+    def add(self, component: Component) -> Component:
+        self._components.append(component)
+        return component
+
+    async def start(self):
+        for component in self._components:
+            await component.setup()
+            self._restarts[component] = 0
+            self._tasks[component] = asyncio.create_task(self._supervise(component),
+                                                         name=component.name)
+            logger.debug(f'组件 {component.name} 已启动')
+
+    async def _supervise(self, component: Component):
+        while True:
+            try:
+                await component.run()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                restarts = self._restarts[component]
+                if restarts >= self.max_restarts:
+                    logger.error(f'组件 {component.name} 崩溃且超过最大重启次数：{e}')
+                    raise
+                self._restarts[component] = restarts + 1
+                logger.error(f'组件 {component.name} 崩溃, {self.restart_delay}s 后第{restarts + 1}次重启：{e}')
+                await asyncio.sleep(self.restart_delay)
+
+    def task(self, component: Component) -> Optional[asyncio.Task]:
+        return self._tasks.get(component)
+
+    async def stop(self):
+        for component in reversed(self._components):
+            task = self._tasks.pop(component, None)
+            component.stop()
+            if task is not None and not task.done():
+                try:
+                    await asyncio.wait_for(task, timeout=self.stop_timeout)
+                except asyncio.TimeoutError:
+                    # stop 已唤醒主循环, 仍未退出说明组件卡住, 已被取消
+                    logger.warning(f'组件 {component.name} {self.stop_timeout}s 内未退出, 已取消')
+                except Exception as e:
+                    logger.error(f'组件 {component.name} 停止失败：{e}')
+            try:
+                await component.teardown()
+            except Exception as e:
+                logger.error(f'组件 {component.name} 资源释放失败：{e}')
+            logger.debug(f'组件 {component.name} 已停止')
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 多进程分片运行
+@Date       : 2024/6/24 21:10
+@Author     : lkkings
+@FileName:  : shard.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import multiprocessing
+import queue
+import signal
+import time
+from dataclasses import dataclass
+from typing import Dict, TYPE_CHECKING
+
+from fastspider.logger import logger
+from fastspider.utils.common import stable_hash
+
+if TYPE_CHECKING:
+    from fastspider.core.engine import Spider
+
+
+@dataclass(frozen=True)
+class Shard:
+    index: int
+    total: int
+
+    def owns(self, task) -> bool:
+        """任务按哈希分区, 判断是否属于当前分片 (Whether the task hashes into this shard)"""
+        return stable_hash(task) % self.total == self.index
+
+
+class ShardRunner:
+    """
+    在父进程中启动N个分片子进程, 汇总各子进程的监控统计并负责停止
+    (Forks N shard workers, aggregates their Monitor counters and handles shutdown)
+    """
+    report_interval = 10
+
+    def __init__(self, spider: "Spider", workers: int):
+        self.spider = spider
+        self.workers = workers
+        methods = multiprocessing.get_all_start_methods()
+        self._ctx = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self._channel = self._ctx.Queue()
+        self._processes = []
+        self._snapshots: Dict[int, Dict] = {}
+        self._stopping = False
+
+    def _handle_signal(self, received_signal, frame):
+        self.stop()
+
+    def stop(self):
+        if self._stopping:
+            return
+        self._stopping = True
+        logger.info(f'{self.spider.name} 正在停止 {self.workers} 个分片进程')
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+
+    def _collect(self, timeout: float):
+        try:
+            index, snapshot = self._channel.get(timeout=timeout)
+            self._snapshots[index] = snapshot
+            while True:
+                index, snapshot = self._channel.get_nowait()
+                self._snapshots[index] = snapshot
+        except queue.Empty:
+            pass
+        self.spider.monitor.merge(self._snapshots.values())
+
+    def run(self):
+        signal.signal(signal.SIGINT, self._handle_signal)
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        for index in range(self.workers):
+            shard = Shard(index, self.workers)
+            process = self._ctx.Process(target=self.spider._run_shard,
+                                        args=(shard, self._channel),
+                                        name=f'{self.spider.name}-shard-{index}')
+            process.start()
+            self._processes.append(process)
+        logger.info(f'{self.spider.name} 已启动 {self.workers} 个分片进程')
+        last_report = time.time()
+        while any(process.is_alive() for process in self._processes):
+            self._collect(timeout=1)
+            if time.time() - last_report >= self.report_interval:
+                logger.debug(self.spider.monitor.report())
+                last_report = time.time()
+        self._collect(timeout=0.1)
+        for process in self._processes:
+            process.join()
+        logger.info(f'{self.spider.name} 分片运行结束 {self.spider.monitor.report()}')
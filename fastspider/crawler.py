@@ -11,6 +11,7 @@ Change Log  :
 
 """
 import asyncio
+import inspect
 import math
 import os.path
 import pickle
@@ -22,7 +23,7 @@ from asyncio import BaseEventLoop, AbstractEventLoop
 
 from concurrent.futures import ThreadPoolExecutor
 from abc import ABC, abstractmethod, abstractclassmethod
-from typing import List, Tuple, Dict, Union, AsyncGenerator
+from typing import List, Tuple, Dict, Union, AsyncGenerator, Callable, Optional
 
 import aiohttp
 from yarl import URL
@@ -30,15 +31,25 @@ from yarl import URL
 from fastspider.downloader import Downloader
 from fastspider.items import Item, UniqueItem
 from fastspider.http import Request, Response
+from fastspider.http.breaker import CircuitBreaker
+from fastspider.http.coalesce import SingleFlight
+from fastspider.http.hedge import Hedger
+from fastspider.core.lifecycle import TaskState
 from fastspider.logger import logger
-from fastspider.exceptions import NotAsyncMethodError, MethodReturnError, APIError, ClassTypeError, Error
+from fastspider.exceptions import NotAsyncMethodError, MethodReturnError, APIError, ClassTypeError, Error, \
+    APICircuitOpenError
 from fastspider.middleware import RedisManager
 from fastspider.middleware.redis import BloomFilter
 from fastspider.monitor import Monitor
+from fastspider.scheduler import PriorityTaskQueue
+from fastspider.scheduler.delay import DelayQueue, backoff
+from fastspider.scheduler.dupefilter import DupeFilter
 from fastspider.storage import get_storage, BaseStorage
 from fastspider.utils._trackref import object_ref
 from fastspider.utils.common import false_empty_afunc
+from fastspider.utils.http_utils import request_fingerprint
 from fastspider.utils.pause_resume import AsyncPauseAbleTask
+from fastspider.utils.queues import WatermarkQueue
 from fastspider.utils.reflection_utils import get_method_return_type
 from fastspider.config import config
 
@@ -47,18 +58,84 @@ class CrawlerTask(object_ref):
     task_id: int
     do: Union[URL, str, Tuple]
     success: bool = False
+    # 已抓取但尚未解析完成的页面数 (Pages fetched but not parsed yet)
+    pending: int = 0
+    # 抓取循环是否结束 (Whether the fetch loop of this task has finished)
+    fetched: bool = False
+    failed: bool = False
+    # 被 remove_task 取消, 引擎结算时既不计为成功也不重试
+    cancelled: bool = False
+
+    # 分页任务: 实现 page_request 并置为 True 后, 爬虫按窗口预取后续页面
+    paginated: bool = False
+    # 下一个待交付的页码, 失败重试时从该页继续
+    page: int = 0
+    # 优先级, 数值越小越先执行 (Lower value runs first)
+    priority: int = 0
+    # 从共享任务队列租用时的租约id
+    lease: str = None
+    # 已重试次数与最近一次失败的异常
+    attempts: int = 0
+    error: Exception = None
+
+    @property
+    def domain(self) -> str:
+        """任务所属域名, 调度器据此在域名之间轮转 (Used by the scheduler for per-domain fairness)"""
+        do = self.do[0] if isinstance(self.do, tuple) and self.do else self.do
+        if isinstance(do, (str, URL)):
+            try:
+                return URL(str(do)).host or ''
+            except ValueError:
+                return ''
+        return ''
+
+    def fingerprint(self) -> Optional[int]:
+        """
+        抓取前去重使用的指纹, 默认只对URL任务生效, 返回 None 表示不去重
+        (Fingerprint for pre-fetch dedup, None disables dedup for this task)
+        """
+        if isinstance(self.do, (str, URL)) and str(self.do).startswith(('http://', 'https://')):
+            return request_fingerprint(str(self.do))
+        return None
 
     async def is_stopped(self, text: str) -> bool:
         return True
 
+    async def page_request(self, task: Union[str, URL, Tuple], page: int, **params) -> Optional[Request]:
+        """
+        构造第 page 页的请求, 页码从0开始, 返回 None 表示没有更多页面
+        (Build the request of page N, return None when there are no more pages)
+        """
+        return None
+
     @abstractclassmethod
     async def dedup(cls, item: UniqueItem, filter) -> bool:
+        """
+        返回数据是否重复 (Whether the item is a duplicate)
+
+        不兼容变更: filter 的 add / exists 等方法现在都是协程, 重写时必须 await, dedup 本身也必须是 async 方法。
+        按旧的同步接口编写的重写(如 `if filter.exists(uid)`)会把未等待的协程当作真值, 导致所有数据被判为重复;
+        非 async 的重写在启动时抛出 TypeError
+        """
         uid = str(item.get('id'))
-        if filter.exists(uid):
-            return True
-        else:
-            filter.add(uid)
-            return False
+        # 检查与写入在一次往返内原子完成, 等待期间事件循环继续抓取与解析
+        return not await filter.add(uid)
+
+    @classmethod
+    def check_dedup(cls):
+        """启动时检查重写的 dedup 是否为 async 方法 (Reject a dedup override written against the old sync API)"""
+        if not inspect.iscoroutinefunction(cls.dedup):
+            raise TypeError(f'{cls.__name__}.dedup 必须是 async 方法, 并 await 过滤器的方法')
+
+    @classmethod
+    async def dedup_many(cls, items: List[UniqueItem], filter) -> List[bool]:
+        """
+        批量去重, 返回每条数据是否重复, 整批只需一次往返; 子类重写了 dedup 时逐条调用 dedup
+        (Batch dedup in one round trip, falls back to dedup when it is overridden)
+        """
+        if getattr(cls.dedup, '__func__', None) is not CrawlerTask.dedup.__func__:
+            return [await cls.dedup(item, filter) for item in items]
+        return [not added for added in await filter.add_many([str(item.get('id')) for item in items])]
 
     @abstractclassmethod
     async def load_tasks(cls, **params) -> AsyncGenerator[Union[URL, str, Tuple], None]:
@@ -83,63 +160,242 @@ class Crawler(AsyncPauseAbleTask):
     def __init__(self, cfg: Dict, loop: AbstractEventLoop = None) -> None:
         cfg = cfg.get('crawler', {}).copy()
         super().__init__(cfg, loop)
-        self._crawler_tasks = {}
-        self._no_crawler_flag = []
-        self._down_queue = asyncio.Queue()
-        # self._executor = ThreadPoolExecutor(max_workers=cfg['parse_thread_num'])
+        self._task_queue = PriorityTaskQueue.from_cfg(cfg.get('task_queue'), high=cfg['thread_num'] * 10)
+        self._retry_priority = cfg.get('retry_priority', 1)
+        retry_cfg = cfg.get('retry', {})
+        self.retry_budget: int = retry_cfg.get('budget', 3)
+        self._retry_base: float = retry_cfg.get('base', 1)
+        self._retry_cap: float = retry_cfg.get('cap', 60)
+        self._delay_queue = DelayQueue(self.put_task_nowait)
+        # 熔断主机的任务暂存在熔断器中, 主机恢复后重新入队
+        self._breaker = CircuitBreaker(cfg, release=self._unpark)
+        self._hedger = Hedger(cfg)
+        self._coalescer = SingleFlight(cfg)
+        self._dupefilter = DupeFilter(cfg)
+        self._down_queue = WatermarkQueue.from_cfg(cfg.get('down_queue'), high=cfg['parse_thread_num'] * 10)
         self.parse_thread_num = cfg['parse_thread_num']
+        self._fetched_callbacks = []
+        # 任务因主机熔断暂存与放出时的回调, 引擎据此在暂存期间归还在途名额; 未设置 on_unpark 时放出的任务直接入队
+        self.on_park: Optional[Callable[[CrawlerTask], None]] = None
+        self.on_unpark: Optional[Callable[[CrawlerTask], None]] = None
+        # 未执行就被取消的任务同样通知回调, 以便引擎结算
+        self._registry.on_drop = self._dropped
 
     @property
-    def down_queue(self):
+    def down_queue(self) -> WatermarkQueue:
         return self._down_queue
 
-    async def put_task(self, task: Union[CrawlerTask, None]):
-        if task and task.task_id in self._no_crawler_flag:
-            self._no_crawler_flag.remove(task.task_id)
+    async def put_task(self, task: Union[CrawlerTask, None], dedup: bool = True):
+        """
+        添加爬虫任务, 任务队列达到高水位时挂起 (Suspends while the task queue is above its high watermark)
+
+        Args:
+            task: CrawlerTask: 爬虫任务, None表示不再有新任务
+            dedup: bool: 是否按指纹去重, 恢复或重新投递的任务不去重
+        """
+        if task:
+            if dedup and await self._dupefilter.seen(task.fingerprint()):
+                # 重复的任务不发出请求, 直接结算
+                logger.debug(f'任务 {task.task_id} 重复, 已跳过：{task.do}')
+                self._fetched(task)
+                return
+            self._registry.queue(task.task_id, task)
         await self._task_queue.put(task)
         if not task:
             self.set_status(1)
 
-    def remove_task(self, task: CrawlerTask):
-        if task.task_id in self._crawler_tasks:
-            _task = self._crawler_tasks[task.task_id]
-            _task.cancel()
-            del self._crawler_tasks[task.task_id]
+    def put_task_nowait(self, task: CrawlerTask):
+        """
+        不受水位限制立即入队, 用于延迟重试与熔断恢复回流的任务, 避免阶段之间互相等待;
+        等待期间被取消的任务不再入队, 直接结算
+        """
+        if self._registry.requeue(task.task_id, task):
+            self._task_queue.put_nowait(task)
+
+    @property
+    def delay_queue(self) -> DelayQueue:
+        return self._delay_queue
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self._breaker
+
+    @property
+    def hedger(self) -> Hedger:
+        return self._hedger
+
+    @property
+    def dupefilter(self) -> DupeFilter:
+        return self._dupefilter
+
+    @property
+    def coalescer(self) -> SingleFlight:
+        return self._coalescer
+
+    async def teardown(self):
+        self._breaker.close()
+        await super().teardown()
+
+    def _park(self, host: str, task: CrawlerTask):
+        self._breaker.park(host, task)
+        if self.on_park:
+            self.on_park(task)
+
+    def _unpark(self, task: CrawlerTask):
+        if self.on_unpark:
+            self.on_unpark(task)
         else:
-            self._no_crawler_flag.append(task.task_id)
+            self.put_task_nowait(task)
+
+    def retry_task(self, task: CrawlerTask):
+        """
+        失败任务降低优先级, 按带抖动的指数退避延迟后重新入队, 等待期间不占用并发
+        (Requeue a failed task with lowered priority after a jittered exponential backoff)
+
+        因主机熔断而失败的任务不计重试次数, 暂存到主机恢复
+        """
+        if isinstance(task.error, APICircuitOpenError):
+            self._park(task.error.host, task)
+            return
+        task.attempts += 1
+        task.priority += self._retry_priority
+        retry_after = getattr(task.error, 'retry_after', None)
+        self._delay_queue.push(task, backoff(task.attempts, self._retry_base, self._retry_cap, retry_after))
+
+    def register_fetched_callback(self, callback: Callable[[CrawlerTask], None]):
+        """注册任务抓取循环结束后的回调 (Called once the fetch loop of a task has finished)"""
+        self._fetched_callbacks.append(callback)
+
+    def finish(self):
+        """所有任务完成, 通知抓取循环与解析阶段退出 (All tasks settled, wake up and stop the loops)"""
+        self._running = False
+        self.set_status(2)
+        self._down_queue.put_nowait((None, -1))
+        self._task_queue.put_nowait(None)
+
+    def remove_task(self, task: CrawlerTask):
+        """取消任务, 运行中的任务立即取消, 排队中的任务出队时丢弃"""
+        self._registry.cancel(task.task_id, task)
+
+    async def _request_text(self, request: Request) -> str:
+        response: Response = await request(self._client, self._cfg['retries'], throttle=self._throttle,
+                                           limiter=self._semaphore, breaker=self._breaker,
+                                           hedger=self._hedger)
+        return await response.r.text()
+
+    async def _download_text(self, request: Request) -> str:
+        if self._coalescer.enable:
+            # 同时发出的相同请求共享一次网络请求与响应内容
+            return await self._coalescer.do(request.fingerprint, lambda: self._request_text(request))
+        return await self._request_text(request)
+
+    async def _deliver(self, crawler_task: CrawlerTask, text: Optional[str]):
+        crawler_task.success = text is not None
+        crawler_task.pending += 1
+        await self._down_queue.put((crawler_task, text))
 
     async def _try_fetch(self, crawler_task: CrawlerTask):
-        request: Request = await crawler_task.request(task=crawler_task.do)
         try:
-            response: Response = await request(self._client, self._cfg['retries'])
-            text = await response.r.text()
-            crawler_task.success = True
-            await self._down_queue.put((crawler_task, text))
-            return text
+            request: Request = await crawler_task.request(task=crawler_task.do)
+            text = await self._download_text(request)
         except Exception as e:
             logger.error(e)
-            crawler_task.success = False
-            await self._down_queue.put((crawler_task, None))
+            crawler_task.error = e
+            text = None
+        await self._deliver(crawler_task, text)
+        return text
+
+    async def _fetch_page(self, crawler_task: CrawlerTask, page: int) -> Optional[str]:
+        request = await crawler_task.page_request(crawler_task.do, page)
+        if request is None:
             return None
+        return await self._download_text(request)
+
+    async def _prefetch(self, crawler_task: CrawlerTask):
+        """
+        分页预取: 保持 prefetch_window 个页面同时在途, 按页码顺序交给解析阶段,
+        某一页满足 is_stopped 后取消之后的页面并丢弃已下载的结果
+        """
+        window = self._cfg.get('prefetch_window', 4)
+        pages: Dict[int, asyncio.Task] = {}
+        current = crawler_task.page
+        next_page = current
+        try:
+            while True:
+                while next_page < current + window:
+                    pages[next_page] = self._loop.create_task(self._fetch_page(crawler_task, next_page))
+                    next_page += 1
+                try:
+                    text = await pages.pop(current)
+                except Exception as e:
+                    logger.error(e)
+                    crawler_task.error = e
+                    await self._deliver(crawler_task, None)
+                    return
+                if text is None:
+                    # 没有更多页面
+                    return
+                await self._deliver(crawler_task, text)
+                current += 1
+                crawler_task.page = current
+                if await crawler_task.is_stopped(text):
+                    return
+        finally:
+            for task in pages.values():
+                task.cancel()
+
+    def _fetched(self, crawler_task: CrawlerTask):
+        crawler_task.fetched = True
+        for callback in self._fetched_callbacks:
+            callback(crawler_task)
+
+    def _dropped(self, crawler_task: CrawlerTask):
+        crawler_task.cancelled = True
+        self._fetched(crawler_task)
 
     async def _fetch(self, crawler_task: CrawlerTask):
-        text = await self._try_fetch(crawler_task)
-        while text and not crawler_task.is_stopped(text):
-            text = await self._try_fetch(crawler_task)
-        self._semaphore.release()
-        if crawler_task.task_id in self._crawler_tasks:
-            del self._crawler_tasks[crawler_task.task_id]
-        if self._task_queue.empty() and self._status == 1:
-            self.set_status(2)
-        if len(self._crawler_tasks) == 0 and self._status == 2:
-            # 如果当前没有在运行的任务且任务队列全部消费完成则可以判定任务结束
-            self._running = False
-            await self._down_queue.put((None, -1))
-            self._task_queue.put_nowait(None)
+        crawler_task.fetched = False
+        crawler_task.cancelled = False
+        crawler_task.error = None
+        task_id = crawler_task.task_id
+        cancelled = False
+        self._semaphore.hold()
+        try:
+            if crawler_task.paginated:
+                await self._prefetch(crawler_task)
+            else:
+                text = await self._try_fetch(crawler_task)
+                while text and not await crawler_task.is_stopped(text):
+                    text = await self._try_fetch(crawler_task)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self._semaphore.release()
+            if not cancelled:
+                self._registry.finish(task_id, failed=crawler_task.error is not None)
+            elif self._registry.state(task_id) == TaskState.CANCELLED:
+                # 被 remove_task 取消, 仍然通知回调以便结算已交付的页面, 但不计为成功
+                self._registry.finish(task_id)
+                self._dropped(crawler_task)
+            else:
+                # 被外部取消(如 Runtime 停止), 不结算, 任务留在引擎在途表中由检查点或租约重新投递
+                self._registry.finish(task_id, cancelled=True)
+        self._fetched(crawler_task)
 
     async def _task_handler(self, task_queue: asyncio.Queue):
         crawler_task: CrawlerTask = await task_queue.get()
-        if not crawler_task or crawler_task.task_id in self._no_crawler_flag:
+        if not crawler_task:
+            self._semaphore.release()
+            return
+        if self._registry.skip(crawler_task.task_id):
+            self._semaphore.release()
+            return
+        domain = crawler_task.domain
+        if not self._breaker.allow(domain):
+            # 主机熔断中, 把并发让给其他主机
+            self._park(domain, crawler_task)
+            self._semaphore.release()
             return
         task = self._loop.create_task(self._fetch(crawler_task))
-        self._crawler_tasks[crawler_task.task_id] = task
+        self._registry.start(crawler_task.task_id, task)
@@ -106,8 +106,6 @@ class Downloader(AsyncPauseAbleTask):
     def __init__(self,cfg: Dict, loop: AbstractEventLoop = None):
         cfg = cfg.get('downloader', {}).copy()
         super().__init__(cfg, loop)
-        self._download_tasks = {}
-        self._no_download_flag = []
         self._save_path = cfg['save_path']
         self._progress = RichConsoleManager().progress
 
@@ -117,22 +115,16 @@ class Downloader(AsyncPauseAbleTask):
 
     async def put_task(self, task: Tuple[Request, str]):
         request, filename = task
-        if request.url in self._no_download_flag:
-            self._no_download_flag.remove(request.url)
+        self._registry.queue(request.url, task)
         await self._task_queue.put((request, filename))
 
     def remove_task(self, request: Request):
-        url = request.url
-        if url in self._download_tasks:
-            task = self._download_tasks[url]
-            task.cancel()
-            del self._download_tasks[request.url]
-        else:
-            self._no_download_flag.append(url)
+        self._registry.cancel(request.url)
 
     async def _download_chunks(self, request: Request, content_length: int, file: Any, task_id: TaskID):
         try:
-            response: Response = await request(self._client, self._cfg['retries'])
+            response: Response = await request(self._client, self._cfg['retries'], throttle=self._throttle,
+                                               limiter=self._semaphore)
             chunk_size = get_chunk_size(content_length)
             async for chunk in response.content.iter_chunked(chunk_size):
                 if SignalManager.is_shutdown_signaled():
@@ -231,12 +223,27 @@ class Downloader(AsyncPauseAbleTask):
             state="completed",
         )
         logger.debug("下载完成, 文件已保存为 {0}".format(full_path))
-        self._semaphore.release()
-        del self._download_tasks[request.url]
+
+    async def _run_download(self, request: Request, filename: str):
+        # 无论下载成功、提前返回还是被取消都要归还并发名额
+        failed = True
+        self._semaphore.hold()
+        try:
+            await self._download(request, filename)
+            failed = False
+        finally:
+            self._semaphore.release()
+            self._registry.finish(request.url, failed=failed)
 
     async def _task_handler(self, task_queue: asyncio.Queue):
-        request, filename = await task_queue.get()
-        if request.url in self._no_download_flag:
+        entry = await task_queue.get()
+        if entry is None:
+            # 结束标记
+            self._semaphore.release()
+            return
+        request, filename = entry
+        if self._registry.skip(request.url):
+            self._semaphore.release()
             return
-        task = self._loop.create_task(self._download(request, filename))
-        self._download_tasks[request.url] = task
+        task = self._loop.create_task(self._run_download(request, filename))
+        self._registry.start(request.url, task)
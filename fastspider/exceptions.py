@@ -8,8 +8,12 @@ class Error(Exception):
 
 
 class APIError(Error):
-    def __init__(self, request, message: str = None):
+    # 服务端通过 Retry-After 要求的等待秒数
+    retry_after: float = None
+
+    def __init__(self, request, message: str = None, retry_after: float = None):
         super().__init__(f'[{self.code}] Desc: {self.description}  API: {request.url}  Message: {message}')
+        self.retry_after = retry_after
 
 
 class APIConnectionError(APIError):
@@ -65,6 +69,16 @@ class APIBadRequestError(APIError):
     description = 'API客户端发送错误请求'
 
 
+class APICircuitOpenError(APIError):
+    """当目标主机熔断时抛出, 请求未发出"""
+    code = 100010
+    description = '目标主机已熔断'
+
+    def __init__(self, request, message: str = None, retry_after: float = None):
+        super().__init__(request, message, retry_after)
+        self.host = request.host
+
+
 class FileError(Error):
     def __init__(self, file_path: Union[Path, str], message: str = None):
         super().__init__(f'[{self.code}] Desc: {self.description}  FilePath: {file_path}  Message: {message}')
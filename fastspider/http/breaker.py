@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 按主机熔断
+@Date       : 2024/6/30 15:20
+@Author     : lkkings
+@FileName:  : breaker.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def is_failure(status: int) -> bool:
+    """连接失败、超时(状态码0)与5xx计为失败 (Connect errors, timeouts and 5xx count as failures)"""
+    return status == 0 or status >= 500
+
+
+class HostBreaker:
+    """
+    单个主机的熔断器 (Circuit breaker of a single host)
+
+    最近 window 次请求中失败率达到 failure_ratio 后熔断 cooldown 秒, 之后进入半开状态放行 probes 个探测任务;
+    探测成功则恢复, 失败则再次熔断且冷却时间加倍, 最长 max_cooldown 秒
+    """
+
+    def __init__(self, cfg: Dict):
+        self.window: int = cfg.get('window', 20)
+        self.min_requests: int = cfg.get('min_requests', 10)
+        self.failure_ratio: float = cfg.get('failure_ratio', 0.5)
+        self.base_cooldown: float = cfg.get('cooldown', 30)
+        self.max_cooldown: float = cfg.get('max_cooldown', 600)
+        self.probes: int = cfg.get('probes', 1)
+        self.state = CLOSED
+        self.cooldown = self.base_cooldown
+        self.opened_at = 0.0
+        self._outcomes: Deque[bool] = deque(maxlen=self.window)
+        self._failures = 0
+        self._probing = 0
+        # 熔断期间暂存的任务 (Tasks parked while the breaker is open)
+        self.parked: Deque[Any] = deque()
+
+    @property
+    def remaining(self) -> float:
+        return max(self.opened_at + self.cooldown - time.monotonic(), 0)
+
+    def allow(self) -> bool:
+        """是否放行一个任务, 半开状态下占用一个探测名额 (Half-open admits at most `probes` tasks)"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return False
+        if self._probing < self.probes:
+            self._probing += 1
+            return True
+        return False
+
+    def record(self, failed: bool) -> Optional[str]:
+        """记录一次请求结果, 状态变化时返回新状态 (Returns the new state on a transition)"""
+        if self.state == HALF_OPEN:
+            self._probing = max(self._probing - 1, 0)
+            if failed:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                return self._open()
+            self.state = CLOSED
+            self.cooldown = self.base_cooldown
+            self._outcomes.clear()
+            self._failures = 0
+            return CLOSED
+        if self.state == OPEN:
+            return None
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._failures -= self._outcomes[0]
+        self._outcomes.append(failed)
+        self._failures += failed
+        if len(self._outcomes) >= self.min_requests and self._failures / len(self._outcomes) >= self.failure_ratio:
+            return self._open()
+        return None
+
+    def _open(self) -> str:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._probing = 0
+        return OPEN
+
+    def half_open(self):
+        self.state = HALF_OPEN
+        self._probing = 0
+
+
+class CircuitBreaker:
+    """
+    按主机熔断 (Per-host circuit breaker)
+
+    熔断主机的任务交给 park 暂存, 不占用并发; 冷却结束后放出探测任务, 主机恢复后将暂存任务交给 release 重新入队。
+    配置 breaker.hosts 可为指定主机单独设置参数
+
+    Args:
+        cfg: dict: 包含 breaker 配置的组件配置
+        release: Callable: 重新入队暂存任务的回调
+    """
+
+    def __init__(self, cfg: Dict, release: Callable[[Any], None] = None):
+        cfg = cfg.get('breaker', {}).copy()
+        self.enable: bool = cfg.pop('enable', False)
+        self._hosts_cfg: Dict[str, Dict] = cfg.pop('hosts', None) or {}
+        self._default_cfg = cfg
+        self._hosts: Dict[str, HostBreaker] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self.release = release
+
+    def host(self, host: str) -> HostBreaker:
+        breaker = self._hosts.get(host)
+        if breaker is None:
+            breaker = HostBreaker({**self._default_cfg, **self._hosts_cfg.get(host, {})})
+            self._hosts[host] = breaker
+        return breaker
+
+    def is_open(self, host: str) -> bool:
+        """主机是否处于熔断状态, 不占用探测名额 (Whether requests to the host should fail fast)"""
+        if not self.enable or not host:
+            return False
+        breaker = self._hosts.get(host)
+        return breaker is not None and breaker.state == OPEN
+
+    def remaining(self, host: str) -> float:
+        breaker = self._hosts.get(host)
+        return breaker.remaining if breaker else 0
+
+    def allow(self, host: str) -> bool:
+        if not self.enable or not host:
+            return True
+        breaker = self._hosts.get(host)
+        return breaker is None or breaker.allow()
+
+    def park(self, host: str, task: Any):
+        """暂存熔断主机的任务 (Park a task until the host recovers)"""
+        self.host(host).parked.append(task)
+
+    def record(self, host: str, status: int):
+        """
+        记录一次请求结果 (Record the outcome of a request)
+
+        Args:
+            host: str: 主机
+            status: int: 状态码, 连接失败或超时为0
+        """
+        if not self.enable or not host:
+            return
+        breaker = self.host(host)
+        state = breaker.record(is_failure(status))
+        if state == OPEN:
+            self._schedule(host, breaker.cooldown)
+        elif state == CLOSED:
+            timer = self._timers.pop(host, None)
+            if timer:
+                timer.cancel()
+            self._drain(breaker)
+
+    def _schedule(self, host: str, delay: float):
+        timer = self._timers.pop(host, None)
+        if timer:
+            timer.cancel()
+        self._timers[host] = asyncio.get_running_loop().call_later(delay, self._half_open, host)
+
+    def _half_open(self, host: str):
+        self._timers.pop(host, None)
+        breaker = self._hosts[host]
+        breaker.half_open()
+        # 放出的任务出队时经 allow 占用探测名额; 探测任务没有产生请求结果时, 冷却后重新放出探测
+        for _ in range(min(breaker.probes, len(breaker.parked))):
+            self.release(breaker.parked.popleft())
+        self._schedule(host, breaker.cooldown)
+
+    def _drain(self, breaker: HostBreaker):
+        while breaker.parked:
+            self.release(breaker.parked.popleft())
+
+    def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+
+    def stats(self) -> Dict:
+        return {
+            host: {'state': b.state, 'parked': len(b.parked)}
+            for host, b in self._hosts.items() if b.state != CLOSED or b.parked
+        }
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 相同请求合并
+@Date       : 2024/7/1 16:30
+@Author     : lkkings
+@FileName:  : coalesce.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """
+    合并同时发出的相同请求 (Coalesce identical in-flight requests)
+
+    同一指纹同时只发出一次请求, 其余调用等待并共享同一结果; ttl 大于0时结果再缓存 ttl 秒,
+    最多缓存 cache_size 条。单个调用方被取消不会取消共享的请求
+    """
+
+    def __init__(self, cfg: Dict):
+        cfg = cfg.get('coalesce', {})
+        self.enable: bool = cfg.get('enable', False)
+        self.ttl: float = cfg.get('ttl', 0)
+        self.cache_size: int = cfg.get('cache_size', 1000)
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._cache: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self.shared = 0
+        self.hits = 0
+
+    def _cached(self, key: Hashable):
+        entry = self._cache.get(key)
+        if entry is None:
+            return False, None
+        expire, value = entry
+        if expire < time.monotonic():
+            del self._cache[key]
+            return False, None
+        self._cache.move_to_end(key)
+        return True, value
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            return
+        if self.ttl > 0:
+            self._cache[key] = (time.monotonic() + self.ttl, task.result())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行或加入相同指纹的请求 (Run `func`, or join the call already in flight for `key`)
+
+        Args:
+            key: 请求指纹
+            func: Callable: 发出请求的协程函数
+        """
+        if self.ttl > 0:
+            hit, value = self._cached(key)
+            if hit:
+                self.hits += 1
+                return value
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        return {'inflight': len(self._inflight), 'shared': self.shared, 'hits': self.hits}
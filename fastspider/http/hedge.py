@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 对冲请求
+@Date       : 2024/7/1 10:05
+@Author     : lkkings
+@FileName:  : hedge.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+import math
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+
+class LatencyTracker:
+    """最近 window 次响应延迟的分位数 (Percentile over the latest `window` latencies)"""
+
+    def __init__(self, window: int = 200, percentile: float = 95):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._percentile = percentile
+        self._cached: Optional[float] = None
+        self._stale = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, latency: float):
+        self._samples.append(latency)
+        self._stale += 1
+
+    def value(self) -> Optional[float]:
+        if not self._samples:
+            return None
+        # 每累计十分之一窗口的新样本才重新排序一次
+        if self._cached is None or self._stale * 10 >= self._samples.maxlen:
+            ordered = sorted(self._samples)
+            index = min(len(ordered) - 1, math.ceil(len(ordered) * self._percentile / 100) - 1)
+            self._cached = ordered[max(index, 0)]
+            self._stale = 0
+        return self._cached
+
+
+class Hedger:
+    """
+    对冲请求 (Request hedging for idempotent requests)
+
+    请求超过主机的 p95 延迟仍未响应时再发出一个相同的请求, 先返回的响应胜出, 另一个请求被取消。
+    每个普通请求为预算增加 budget 个令牌, 对冲消耗一个令牌, 对冲请求数不超过普通请求数的 budget 倍
+    """
+
+    def __init__(self, cfg: Dict):
+        cfg = cfg.get('hedge', {})
+        self.enable: bool = cfg.get('enable', False)
+        self.percentile: float = cfg.get('percentile', 95)
+        self.window: int = cfg.get('window', 200)
+        self.min_samples: int = cfg.get('min_samples', 20)
+        self.min_delay: float = cfg.get('min_delay', 0.05)
+        self.budget: float = cfg.get('budget', 0.05)
+        self.burst: float = cfg.get('burst', 10)
+        self._tokens = 0.0
+        self._hosts: Dict[str, LatencyTracker] = {}
+        self.hedged = 0
+        self.wins = 0
+
+    def record(self, host: str, latency: float):
+        tracker = self._hosts.get(host)
+        if tracker is None:
+            tracker = self._hosts[host] = LatencyTracker(self.window, self.percentile)
+        tracker.add(latency)
+
+    def delay(self, host: str) -> Optional[float]:
+        """发出对冲请求前的等待时间, 样本不足时不对冲 (None while there are too few samples)"""
+        tracker = self._hosts.get(host)
+        if tracker is None or len(tracker) < self.min_samples:
+            return None
+        return max(tracker.value(), self.min_delay)
+
+    def _acquire(self) -> bool:
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def send(self, host: str, send: Callable[[], Awaitable[Any]],
+                   discard: Callable[[Any], None] = None) -> Any:
+        """
+        发送请求, 超过对冲延迟后发出对冲请求 (Send, firing a duplicate once the hedge delay passes)
+
+        Args:
+            host: str: 主机
+            send: Callable: 发出一次请求的协程函数
+            discard: Callable: 释放落败请求已返回的结果, 例如关闭响应
+        """
+        self._tokens = min(self._tokens + self.budget, self.burst)
+        delay = self.delay(host)
+        primary = asyncio.ensure_future(send())
+        if delay is None:
+            return await primary
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done or not self._acquire():
+            return await primary
+        self.hedged += 1
+        backup = asyncio.ensure_future(send())
+        futures = pending = {primary, backup}
+        winner = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [future for future in done if future.exception() is None]
+                if succeeded or not pending:
+                    # 都失败时抛出最后一个异常
+                    winner = succeeded[0] if succeeded else done.pop()
+                    break
+            if winner is backup:
+                self.wins += 1
+            return winner.result()
+        finally:
+            for future in futures:
+                if future is winner:
+                    continue
+                if not future.done():
+                    future.cancel()
+                elif discard and not future.cancelled() and future.exception() is None:
+                    discard(future.result())
+
+    def stats(self) -> Dict:
+        return {'hedged': self.hedged, 'wins': self.wins}
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 自适应并发上限
+@Date       : 2024/6/29 16:50
+@Author     : lkkings
+@FileName:  : limiter.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional, Tuple
+
+# 视为服务端过载的状态码, 0 表示连接失败或超时 (Status codes counted as errors, 0 for connect failure / timeout)
+ERROR_STATUS = (0, 429)
+
+# 当前任务持有名额的限制器与持有者; 子任务继承上下文, 但不是持有者, 不能让出名额
+_holder: ContextVar[Optional[Tuple['AdaptiveLimiter', asyncio.Task]]] = ContextVar('limiter_holder', default=None)
+
+
+class AdaptiveLimiter:
+    """
+    可在运行中调整上限的并发限制器, 接口与 asyncio.Semaphore 一致
+    (Resizable concurrency limiter with the asyncio.Semaphore interface)
+
+    开启 concurrency.enable 后按 AIMD 调整上限: 每 window 个响应统计一次,
+    平均延迟不超过基线的 latency_tolerance 倍且错误率不超过 error_rate 时, 若上限已被用满则加 increase;
+    否则上限乘以 decrease。基线为观测到的最低窗口平均延迟, 并缓慢向当前延迟回归以适应目标站点变化。
+    """
+
+    def __init__(self, cfg: Dict):
+        limit = cfg['thread_num']
+        cfg = cfg.get('concurrency', {})
+        self.enable: bool = cfg.get('enable', False)
+        self.min_limit: int = cfg.get('min', 1)
+        self.max_limit: int = cfg.get('max', max(limit, 1) * 4)
+        self.increase: int = cfg.get('increase', 1)
+        self.decrease: float = cfg.get('decrease', 0.5)
+        self.window: int = cfg.get('window', 20)
+        self.latency_tolerance: float = cfg.get('latency_tolerance', 2.0)
+        self.error_rate: float = cfg.get('error_rate', 0.1)
+        self._limit = limit
+        self._inflight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._baseline = None
+        self._latency_sum = 0.0
+        self._errors = 0
+        self._samples = 0
+        self._saturated = False
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @limit.setter
+    def limit(self, value: int):
+        """手动调整上限, 立即唤醒可以运行的等待者 (Resize the limit and wake waiters that now fit)"""
+        self._limit = max(int(value), self.min_limit)
+        self._wake()
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def locked(self) -> bool:
+        return self._inflight >= self._limit
+
+    async def acquire(self):
+        if not self._waiters and self._inflight < self._limit:
+            self._inflight += 1
+            return True
+        self._saturated = True
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配到名额后被取消, 归还名额
+                self.release()
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+        return True
+
+    def release(self):
+        self._inflight -= 1
+        self._wake()
+
+    def hold(self):
+        """
+        标记当前任务持有一个名额, 之后只有该任务本身的 yielded 会让出名额
+        (Mark the current task as the slot holder; only its own yielded() gives the slot up)
+
+        分页预取、合并请求等在子任务中发出的请求共用持有者的名额, 在其中让出会重复归还同一个名额
+        """
+        _holder.set((self, asyncio.current_task()))
+
+    @asynccontextmanager
+    async def yielded(self):
+        """
+        等待期间让出调用方持有的名额, 结束后重新获取 (Give up the held slot while waiting, then take it back)
+
+        只在 hold 标记的持有者任务内生效, 其他任务中不做任何事;
+        等待或重新获取被取消时直接占回名额, 保证持有者退出时的 release 与之配对
+        """
+        if _holder.get() != (self, asyncio.current_task()):
+            yield
+            return
+        self.release()
+        try:
+            yield
+        except BaseException:
+            self._inflight += 1
+            raise
+        try:
+            await self.acquire()
+        except asyncio.CancelledError:
+            self._inflight += 1
+            raise
+
+    def _wake(self):
+        while self._waiters and self._inflight < self._limit:
+            future = self._waiters.popleft()
+            if not future.done():
+                self._inflight += 1
+                future.set_result(True)
+
+    def feedback(self, latency: float, status: int):
+        """
+        记录一次响应, 满一个窗口后调整上限 (Record a response and adjust the limit once per window)
+
+        Args:
+            latency: float: 响应延迟, 秒
+            status: int: 状态码, 连接失败或超时为0
+        """
+        if not self.enable:
+            return
+        self._latency_sum += latency
+        self._errors += status in ERROR_STATUS or status >= 500
+        self._samples += 1
+        if self._inflight >= self._limit:
+            self._saturated = True
+        if self._samples < self.window:
+            return
+        latency = self._latency_sum / self._samples
+        error_rate = self._errors / self._samples
+        saturated = self._saturated
+        self._latency_sum, self._errors, self._samples, self._saturated = 0.0, 0, 0, False
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        else:
+            self._baseline += (latency - self._baseline) * 0.05
+        if error_rate > self.error_rate or latency > self._baseline * self.latency_tolerance:
+            self.limit = max(self.min_limit, int(self._limit * self.decrease))
+        elif saturated and self._limit < self.max_limit:
+            self.limit = min(self.max_limit, self._limit + self.increase)
+
+    def stats(self) -> Dict:
+        return {
+            'limit': self._limit,
+            'inflight': self._inflight,
+            'waiting': len(self._waiters),
+        }
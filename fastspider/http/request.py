@@ -11,22 +11,50 @@ Change Log  :
 
 """
 import asyncio
+import json
+import time
+from email.utils import parsedate_to_datetime
 
 from dataclasses import dataclass, field, asdict
 from typing import Optional, Dict, Any
 import aiohttp
 from aiohttp import ClientResponse
 from aiohttp.client_exceptions import ClientConnectorError
+from yarl import URL
 
 from fastspider.exceptions import APIBadRequestError, APIUnauthorizedError, APINotFoundError, APIUnavailableError, \
-    APITimeoutError, APIConnectionError, APIError, APIRetryExhaustedError
+    APITimeoutError, APIConnectionError, APIError, APIRetryExhaustedError, APIRateLimitError, APICircuitOpenError
 from fastspider.http.response import Response
+from fastspider.http.breaker import CircuitBreaker
+from fastspider.http.hedge import Hedger
+from fastspider.http.limiter import AdaptiveLimiter
+from fastspider.http.throttle import AutoThrottle
+from fastspider.scheduler.delay import backoff
 from fastspider.logger import logger
 from fastspider.utils._trackref import object_ref
+from fastspider.utils.http_utils import request_fingerprint
+
+
+def get_retry_after(response: ClientResponse) -> Optional[float]:
+    """解析 Retry-After 响应头, 支持秒数与HTTP日期两种格式 (Parse Retry-After in seconds or HTTP-date)"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
 
 
 class Request(object_ref):
     excluded_error_codes = []
+    # 请求级重试的退避参数 (Backoff between request level retries)
+    backoff_base = 0.5
+    backoff_cap = 30
 
     def __init__(
             self,
@@ -59,6 +87,24 @@ class Request(object_ref):
     def url(self) -> str:
         return self._url
 
+    @property
+    def host(self) -> str:
+        return URL(str(self._url)).host or ''
+
+    @property
+    def idempotent(self) -> bool:
+        """幂等请求才允许对冲 (Only idempotent requests may be hedged)"""
+        return self.method in ('GET', 'HEAD')
+
+    @property
+    def fingerprint(self) -> int:
+        """请求指纹, 由方法、规范化URL与请求体决定 (Fingerprint of method, canonical URL and body)"""
+        url = str(self._url)
+        if self.kwargs.get('params'):
+            url = str(URL(url).update_query(self.kwargs['params']))
+        body = {key: self.kwargs[key] for key in ('data', 'json') if self.kwargs.get(key) is not None}
+        return request_fingerprint(url, self.method, json.dumps(body, sort_keys=True, default=str) if body else None)
+
     def raise_for_status(self, response: ClientResponse) -> None:
         if response.status == 200 or response.status in self.excluded_error_codes:
             return
@@ -68,25 +114,72 @@ class Request(object_ref):
             raise APIUnauthorizedError(self)
         elif response.status == 404:
             raise APINotFoundError(self)
+        elif response.status == 429:
+            raise APIRateLimitError(self, retry_after=get_retry_after(response))
         else:
-            raise APIUnavailableError(self)
+            raise APIUnavailableError(self, retry_after=get_retry_after(response))
+
+    async def __call__(self, client: aiohttp.ClientSession, retries: int, *args,
+                       throttle: AutoThrottle = None, limiter: AdaptiveLimiter = None,
+                       breaker: CircuitBreaker = None, hedger: Hedger = None,
+                       attempt: int = 0, **kwargs) -> Response:
+        """
+        发出请求, 失败时在请求内退避重试 retries 次
+
+        limiter 为调用方的并发限制器, 在持有名额的任务内调用时, 限速与退避等待期间让出名额, 发出请求前重新获取
+        """
+        host = self.host
+        if breaker and breaker.is_open(host):
+            # 熔断期间不发出请求, 由调用方暂存任务
+            raise APICircuitOpenError(self, retry_after=breaker.remaining(host))
+
+        async def wait(awaitable):
+            if limiter is None:
+                return await awaitable
+            async with limiter.yielded():
+                await awaitable
+
+        if throttle and not throttle.try_acquire(host):
+            await wait(throttle.acquire(host))
+        start = time.monotonic()
+
+        def feedback(status: int):
+            latency = time.monotonic() - start
+            if throttle:
+                throttle.feedback(host, latency, status)
+            if limiter:
+                limiter.feedback(latency, status)
+            if breaker:
+                breaker.record(host, status)
+
+        def send():
+            return client.request(method=self.method,
+                                  url=self.url,
+                                  headers=self.headers,
+                                  proxy=self.proxy,
+                                  cookies=self.cookies,
+                                  **self.kwargs)
 
-    async def __call__(self, client: aiohttp.ClientSession, retries: int, *args, **kwargs) -> Response:
         try:
-            response = await client.request(method=self.method,
-                                            url=self.url,
-                                            headers=self.headers,
-                                            proxy=self.proxy,
-                                            cookies=self.cookies,
-                                            **self.kwargs)
+            if hedger and hedger.enable and self.idempotent:
+                response = await hedger.send(host, send, discard=lambda r: r.release())
+                hedger.record(host, time.monotonic() - start)
+            else:
+                response = await send()
+            feedback(response.status)
             self.raise_for_status(response)
             return Response(response=response)
         except asyncio.TimeoutError:
+            feedback(0)
             raise APITimeoutError(self)
         except ClientConnectorError:
+            feedback(0)
             raise APIConnectionError(self)
         except APIError as e:
             logger.error(e)
-            if retries > 0:
-                return await self(client, retries - 1, *args, **kwargs)
-            raise APIRetryExhaustedError(self)
+            # Retry-After 超过退避上限时不在请求内等待, 交给任务级的延迟重试, 避免长时间占用并发
+            if retries > 0 and (e.retry_after or 0) <= self.backoff_cap:
+                await wait(asyncio.sleep(backoff(attempt + 1, self.backoff_base, self.backoff_cap, e.retry_after)))
+                return await self(client, retries - 1, *args, throttle=throttle, limiter=limiter,
+                                  breaker=breaker, hedger=hedger, attempt=attempt + 1, **kwargs)
+            raise APIRetryExhaustedError(self, retry_after=e.retry_after)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 按主机自适应限速
+@Date       : 2024/6/28 14:05
+@Author     : lkkings
+@FileName:  : throttle.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+import time
+from typing import Dict
+
+# 服务端要求降速的状态码 (Status codes asking the client to slow down)
+BACKOFF_STATUS = (429, 503)
+
+
+class TokenBucket:
+    """令牌桶, rate 为每秒生成的令牌数 (Token bucket refilled at `rate` tokens per second)"""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        """不等待地取一个令牌, 令牌不足时返回 False (Take a token without waiting)"""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class HostThrottle:
+    """
+    单个主机的限速状态, 算法参考 Scrapy AutoThrottle:
+    目标延迟 = 响应延迟 / 目标并发数, 新延迟取旧延迟与目标延迟的均值;
+    非200响应不会降低延迟, 429/503 直接加倍延迟
+    """
+
+    def __init__(self, cfg: Dict):
+        self.min_delay: float = cfg.get('min_delay', 0.0)
+        self.max_delay: float = cfg.get('max_delay', 60.0)
+        self.target_concurrency: float = cfg.get('target_concurrency', 8.0)
+        self.delay: float = cfg.get('start_delay', 0.1)
+        self.bucket = TokenBucket(self._rate(self.delay), burst=cfg.get('burst', self.target_concurrency))
+
+    @staticmethod
+    def _rate(delay: float) -> float:
+        return 1 / delay if delay > 0 else float('inf')
+
+    def _set_delay(self, delay: float):
+        self.delay = min(max(delay, self.min_delay), self.max_delay)
+        self.bucket.rate = self._rate(self.delay)
+
+    def try_acquire(self) -> bool:
+        return self.delay <= 0 or self.bucket.try_acquire()
+
+    async def acquire(self):
+        if self.delay > 0:
+            await self.bucket.acquire()
+
+    def feedback(self, latency: float, status: int):
+        if status in BACKOFF_STATUS or status == 0:
+            self._set_delay(max(self.delay, self.min_delay, 0.1) * 2)
+            return
+        target = latency / self.target_concurrency
+        delay = (self.delay + target) / 2
+        if status != 200 and delay < self.delay:
+            return
+        self._set_delay(max(target, delay))
+
+
+class AutoThrottle:
+    """
+    按主机自适应限速 (Per-host adaptive rate limiter)
+
+    配置 throttle.hosts 可为指定主机单独设置参数, 其中 enable: false 表示不限速
+    """
+
+    def __init__(self, cfg: Dict):
+        cfg = cfg.get('throttle', {}).copy()
+        self.enable: bool = cfg.pop('enable', False)
+        self._hosts_cfg: Dict[str, Dict] = cfg.pop('hosts', None) or {}
+        self._default_cfg = cfg
+        self._hosts: Dict[str, HostThrottle] = {}
+
+    def host(self, host: str):
+        throttle = self._hosts.get(host)
+        if throttle is None:
+            cfg = {**self._default_cfg, **self._hosts_cfg.get(host, {})}
+            throttle = HostThrottle(cfg) if cfg.get('enable', True) else None
+            self._hosts[host] = throttle
+        return throttle
+
+    def try_acquire(self, host: str) -> bool:
+        """不等待地取得主机的发送许可, 需要等待时返回 False (Non-blocking acquire, False when it would wait)"""
+        if not self.enable:
+            return True
+        throttle = self.host(host)
+        return throttle is None or throttle.try_acquire()
+
+    async def acquire(self, host: str):
+        if not self.enable:
+            return
+        throttle = self.host(host)
+        if throttle:
+            await throttle.acquire()
+
+    def feedback(self, host: str, latency: float, status: int):
+        """
+        根据响应调整主机速率 (Adjust the host rate from an observed response)
+
+        Args:
+            host: str: 主机
+            latency: float: 响应延迟, 秒
+            status: int: 状态码, 连接失败或超时为0
+        """
+        if not self.enable:
+            return
+        throttle = self.host(host)
+        if throttle:
+            throttle.feedback(latency, status)
+
+    def stats(self) -> Dict:
+        return {host: round(t.delay, 3) for host, t in self._hosts.items() if t}
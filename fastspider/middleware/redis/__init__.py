@@ -1,27 +1,142 @@
 import hashlib
 import math
-from typing import Dict
+import pickle
+import time
+import uuid
+from typing import Dict, List, Tuple, Any, Iterable
 
 import redis
+import redis.asyncio
 from fastspider.utils._singleton import Singleton
 
 
 class RedisManager(metaclass=Singleton):
     def __init__(self, cfg: Dict):
         _redis_cfg = cfg.get('redis', {}).copy()
+        # 异步连接池大小与取连接的等待秒数, 连接用尽时等待而不是报错
+        self._pool_size = _redis_cfg.pop('max_connections', 50)
+        self._pool_timeout = _redis_cfg.pop('pool_timeout', 20)
+        self._redis_cfg = _redis_cfg
         self.redis_conn = redis.StrictRedis(**_redis_cfg)
+        self._async_conn = None
+
+    @property
+    def async_conn(self) -> redis.asyncio.Redis:
+        """异步连接, 首次使用时创建连接池, 分片子进程各自持有自己的连接池"""
+        if self._async_conn is None:
+            pool = redis.asyncio.BlockingConnectionPool(max_connections=self._pool_size,
+                                                        timeout=self._pool_timeout,
+                                                        **self._redis_cfg)
+            self._async_conn = redis.asyncio.Redis(connection_pool=pool)
+        return self._async_conn
+
+    async def aclose(self):
+        """关闭异步连接池 (Close the async connection pool)"""
+        if self._async_conn is not None:
+            conn, self._async_conn = self._async_conn, None
+            await conn.aclose()
+            await conn.connection_pool.disconnect()
 
     def create_bloom_filter(self, name, capacity, error_rate=0.001):
         return BloomFilter(self.redis_conn, name, capacity, error_rate)
 
+    def create_async_bloom_filter(self, name, capacity, error_rate=0.001):
+        return AsyncBloomFilter(self.async_conn, name, capacity, error_rate)
+
+    def create_async_scalable_bloom_filter(self, name, capacity, error_rate=0.001, growth=2,
+                                           tightening=0.5, fill_ratio=1.0):
+        return AsyncScalableBloomFilter(self.async_conn, name, capacity, error_rate, growth, tightening, fill_ratio)
+
+    def create_async_cuckoo_filter(self, name, capacity, interval, generations=4):
+        return AsyncCuckooFilter(self.async_conn, name, capacity, interval, generations)
+
+    def create_async_queue(self, name):
+        return AsyncNamedQueue(self.async_conn, name)
+
+    def create_async_list(self, name):
+        return AsyncNamedList(self.async_conn, name)
+
+    def create_async_set(self, name):
+        return AsyncNamedSet(self.async_conn, name)
+
     def create_queue(self, name):
         return NamedQueue(self.redis_conn, name)
 
     def create_list(self, name):
         return NamedList(self.redis_conn, name)
 
+    def create_set(self, name):
+        return NamedSet(self.redis_conn, name)
+
+    def create_frontier(self, name, visibility_timeout=300):
+        return RedisFrontier(self.redis_conn, name, visibility_timeout)
+
+
+class _LegacyBitArray:
+    """
+    改用双重哈希之前的位数组 `{name}:bitarray`, 升级后只读 (Read-only pre-double-hashing bit array)
+
+    旧版本固定误判率 0.001, 位置为 (md5 + i) mod num_bits。键存在时其中的元素仍视为重复,
+    再次出现的元素同时写入新的位数组; 旧数据不再需要时删除该键即可停止读取
+    """
+    ERROR_RATE = 0.001
+
+    def __init__(self, name, capacity):
+        self.key = f"{name}:bitarray"
+        self.num_bits = math.ceil(capacity * abs(math.log(self.ERROR_RATE)) / (math.log(2) ** 2))
+        self.num_hashes = math.ceil(self.num_bits * math.log(2) / capacity)
+
+    def args(self, items: List) -> List[int]:
+        """_BloomFilterBase.EXISTS_SCRIPT 的参数 (Arguments for EXISTS_SCRIPT over the legacy key)"""
+        args = [self.num_hashes]
+        for item in items:
+            if isinstance(item, bytes):
+                item = item.decode('utf-8')
+            seed = int(hashlib.md5(str(item).encode('utf-8')).hexdigest(), 16)
+            args.extend((seed + i) % self.num_bits for i in range(self.num_hashes))
+        return args
+
+
+class _BloomFilterBase:
+    """
+    Redis 布隆过滤器, 使用双重哈希计算位置, 批量检查与写入均在一次往返内原子完成
+    (Redis Bloom filter with double hashing; batch check-and-add in a single atomic round trip)
+    """
+    # KEYS: bitarray  ARGV: num_hashes, 每个元素的 num_hashes 个位置依次排列
+    # 返回每个元素写入前是否已存在, 同一批次中重复的元素按顺序判断
+    ADD_SCRIPT = """
+    local k = tonumber(ARGV[1])
+    local result = {}
+    local n = (#ARGV - 1) / k
+    for i = 0, n - 1 do
+        local existed = 1
+        for j = 1, k do
+            if redis.call('SETBIT', KEYS[1], ARGV[1 + i * k + j], 1) == 0 then
+                existed = 0
+            end
+        end
+        result[i + 1] = existed
+    end
+    return result
+    """
+    # KEYS: bitarray  ARGV: 同 ADD_SCRIPT, 只读
+    EXISTS_SCRIPT = """
+    local k = tonumber(ARGV[1])
+    local result = {}
+    local n = (#ARGV - 1) / k
+    for i = 0, n - 1 do
+        local existed = 1
+        for j = 1, k do
+            if redis.call('GETBIT', KEYS[1], ARGV[1 + i * k + j]) == 0 then
+                existed = 0
+                break
+            end
+        end
+        result[i + 1] = existed
+    end
+    return result
+    """
 
-class BloomFilter:
     def __init__(self, redis_conn, name, capacity, error_rate=0.001):
         self.redis_conn = redis_conn
         self.name = name
@@ -32,37 +147,72 @@ class BloomFilter:
         self.num_bits = math.ceil(capacity * abs(math.log(error_rate)) / (math.log(2) ** 2))
         self.num_hashes = math.ceil(self.num_bits * math.log(2) / capacity)
 
-        # Redis key names
-        self.bit_array_key = f"{self.name}:bitarray"
+        # Redis key names, 位置算法改为双重哈希后使用新的键, 避免与旧的位数组混用; 旧位数组存在时只读
+        self.bit_array_key = f"{self.name}:bitarray:dh"
         self.num_hashes_key = f"{self.name}:num_hashes"
+        self.legacy = _LegacyBitArray(self.name, capacity)
+        self._has_legacy = False
 
+    def _args(self, items: List) -> List[int]:
+        args = [self.num_hashes]
+        for item in items:
+            args.extend(self._calculate_hashes(item))
+        return args
+
+    def _calculate_hashes(self, item):
+        """
+        双重哈希 h1 + i * h2 (Kirsch-Mitzenmacher), 取 md5 的高低64位作为两个独立哈希
+        (Double hashing over the two 64-bit halves of md5)
+        """
+        if not isinstance(item, bytes):
+            item = str(item).encode('utf-8')
+        digest = hashlib.md5(item).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        # h2 为奇数, 与 num_bits 互素的概率更高, 避免位置退化成循环
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+
+class BloomFilter(_BloomFilterBase):
+    def __init__(self, redis_conn, name, capacity, error_rate=0.001):
+        super().__init__(redis_conn, name, capacity, error_rate)
         # Initialize the bit array in Redis if it doesn't exist
         if not self.redis_conn.exists(self.bit_array_key):
             self.redis_conn.setbit(self.bit_array_key, self.num_bits - 1, 0)
             self.redis_conn.set(self.num_hashes_key, self.num_hashes)
+        self._has_legacy = bool(self.redis_conn.exists(self.legacy.key))
+        self._add_script = self.redis_conn.register_script(self.ADD_SCRIPT)
+        self._exists_script = self.redis_conn.register_script(self.EXISTS_SCRIPT)
 
-    def add(self, item):
-        hashes = self._calculate_hashes(item)
-        for hash_value in hashes:
-            self.redis_conn.setbit(self.bit_array_key, hash_value % self.num_bits, 1)
+    def _legacy_exists(self, items: List) -> List[bool]:
+        if not self._has_legacy:
+            return [False] * len(items)
+        return [bool(existed) for existed in self._exists_script(keys=[self.legacy.key], args=self.legacy.args(items))]
 
-    def exists(self, item):
-        hashes = self._calculate_hashes(item)
-        for hash_value in hashes:
-            if not self.redis_conn.getbit(self.bit_array_key, hash_value % self.num_bits):
-                return False
-        return True
+    def add(self, item) -> bool:
+        """写入元素, 返回写入前是否不存在 (Atomic check-and-add, True if the item was new)"""
+        return self.add_many([item])[0]
 
-    def _calculate_hashes(self, item):
-        hashes = []
-        md5 = hashlib.md5()
-        md5.update(item.encode('utf-8'))
-        seed = int(md5.hexdigest(), 16)
+    def add_if_absent(self, item) -> bool:
+        return self.add(item)
+
+    def exists(self, item) -> bool:
+        return self.exists_many([item])[0]
 
-        for i in range(self.num_hashes):
-            hash_value = (seed + i) % self.num_bits
-            hashes.append(hash_value)
-        return hashes
+    def add_many(self, items: Iterable) -> List[bool]:
+        """批量写入, 返回每个元素写入前是否不存在 (True for each item that was new)"""
+        items = list(items)
+        if not items:
+            return []
+        result = self._add_script(keys=[self.bit_array_key], args=self._args(items))
+        return [not existed and not legacy for existed, legacy in zip(result, self._legacy_exists(items))]
+
+    def exists_many(self, items: Iterable) -> List[bool]:
+        items = list(items)
+        if not items:
+            return []
+        result = self._exists_script(keys=[self.bit_array_key], args=self._args(items))
+        return [bool(existed) or legacy for existed, legacy in zip(result, self._legacy_exists(items))]
 
 
 class NamedQueue:
@@ -114,3 +264,675 @@ class NamedList:
 
     def all(self):
         return self.redis_conn.lrange(self.name, 0, -1)
+
+
+class NamedSet:
+    def __init__(self, redis_conn, name):
+        self.redis_conn = redis_conn
+        self.name = name
+
+    def add(self, item) -> bool:
+        """返回是否为新元素 (Returns True if the item was not in the set)"""
+        return bool(self.redis_conn.sadd(self.name, item))
+
+    def contains(self, item) -> bool:
+        return bool(self.redis_conn.sismember(self.name, item))
+
+    def remove(self, item):
+        self.redis_conn.srem(self.name, item)
+
+    def size(self):
+        return self.redis_conn.scard(self.name)
+
+    def exists(self):
+        return self.redis_conn.exists(self.name)
+
+
+class AsyncBloomFilter(_BloomFilterBase):
+    """基于 redis.asyncio 的布隆过滤器, 不阻塞事件循环 (Bloom filter on redis.asyncio)"""
+
+    def __init__(self, redis_conn, name, capacity, error_rate=0.001):
+        super().__init__(redis_conn, name, capacity, error_rate)
+        self._add_script = self.redis_conn.register_script(self.ADD_SCRIPT)
+        self._exists_script = self.redis_conn.register_script(self.EXISTS_SCRIPT)
+        self._initialized = False
+
+    async def _ensure(self):
+        # 构造函数中不能等待, 位数组在第一次使用时初始化
+        if self._initialized:
+            return
+        if not await self.redis_conn.exists(self.bit_array_key):
+            await self.redis_conn.setbit(self.bit_array_key, self.num_bits - 1, 0)
+            await self.redis_conn.set(self.num_hashes_key, self.num_hashes)
+        self._has_legacy = bool(await self.redis_conn.exists(self.legacy.key))
+        self._initialized = True
+
+    async def _legacy_exists(self, items: List) -> List[bool]:
+        if not self._has_legacy:
+            return [False] * len(items)
+        result = await self._exists_script(keys=[self.legacy.key], args=self.legacy.args(items))
+        return [bool(existed) for existed in result]
+
+    async def add(self, item) -> bool:
+        return (await self.add_many([item]))[0]
+
+    async def add_if_absent(self, item) -> bool:
+        return await self.add(item)
+
+    async def exists(self, item) -> bool:
+        return (await self.exists_many([item]))[0]
+
+    async def add_many(self, items: Iterable) -> List[bool]:
+        items = list(items)
+        if not items:
+            return []
+        await self._ensure()
+        result = await self._add_script(keys=[self.bit_array_key], args=self._args(items))
+        return [not existed and not legacy for existed, legacy in zip(result, await self._legacy_exists(items))]
+
+    async def exists_many(self, items: Iterable) -> List[bool]:
+        items = list(items)
+        if not items:
+            return []
+        await self._ensure()
+        result = await self._exists_script(keys=[self.bit_array_key], args=self._args(items))
+        return [bool(existed) or legacy for existed, legacy in zip(result, await self._legacy_exists(items))]
+
+
+class AsyncScalableBloomFilter:
+    """
+    可扩容的布隆过滤器 (Scalable Bloom filter, Almeida et al. 2007)
+
+    由多个分片组成, 第 i 个分片容量为 capacity * growth^i、误判率为 error_rate * tightening^i;
+    当前分片写入数达到容量的 fill_ratio 后新增分片, 总误判率不超过 error_rate / (1 - tightening)。
+    检查所有分片与写入当前分片在一次往返内原子完成, 分片元数据保存在 Redis 中, 多进程共享。
+    第0个分片与 BloomFilter 使用相同的键与参数, 已有的固定容量过滤器可以直接升级;
+    与 BloomFilter 相同, 双重哈希之前的旧位数组存在时只读, 其中的元素仍视为重复
+    """
+    # KEYS: meta, 各分片位数组  ARGV: 分片数, 扩容阈值, 各分片哈希数, 每个元素在各分片的位置依次排列
+    # 分片数与 meta 不一致时返回 {-1}, 由客户端刷新分片后重试; 否则返回每个元素写入前是否已存在,
+    # 当前分片写满时新增分片并提前返回, 返回的结果少于元素数, 其余元素由客户端刷新分片后重新提交
+    ADD_SCRIPT = """
+    local n = tonumber(ARGV[1])
+    local slices = tonumber(redis.call('HGET', KEYS[1], 'slices') or '1')
+    if slices ~= n then
+        return {-1}
+    end
+    local threshold = tonumber(ARGV[2])
+    local ks = {}
+    local per_item = 0
+    for s = 1, n do
+        ks[s] = tonumber(ARGV[2 + s])
+        per_item = per_item + ks[s]
+    end
+    local offset = 2 + n
+    local count = (#ARGV - offset) / per_item
+    local filled = tonumber(redis.call('HGET', KEYS[1], 'count:' .. (n - 1)) or '0')
+    local result = {}
+    local added = 0
+    for i = 0, count - 1 do
+        if filled + added >= threshold then
+            break
+        end
+        local pos = offset + i * per_item
+        local existed = 0
+        for s = 1, n do
+            local all = 1
+            for j = 1, ks[s] do
+                if redis.call('GETBIT', KEYS[1 + s], ARGV[pos + j]) == 0 then
+                    all = 0
+                    break
+                end
+            end
+            if all == 1 then
+                existed = 1
+                break
+            end
+            pos = pos + ks[s]
+        end
+        if existed == 0 then
+            local last = offset + i * per_item + per_item - ks[n]
+            for j = 1, ks[n] do
+                redis.call('SETBIT', KEYS[1 + n], ARGV[last + j], 1)
+            end
+            added = added + 1
+        end
+        result[i + 1] = existed
+    end
+    if added > 0 then
+        redis.call('HINCRBY', KEYS[1], 'count:' .. (n - 1), added)
+    end
+    if filled + added >= threshold then
+        redis.call('HSET', KEYS[1], 'slices', n + 1)
+    end
+    return result
+    """
+
+    def __init__(self, redis_conn, name, capacity, error_rate=0.001, growth=2, tightening=0.5, fill_ratio=1.0):
+        self.redis_conn = redis_conn
+        self.name = name
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.fill_ratio = fill_ratio
+        self.meta_key = f"{self.name}:scalable"
+        self._script = self.redis_conn.register_script(self.ADD_SCRIPT)
+        self.legacy = _LegacyBitArray(self.name, capacity)
+        self._legacy_script = self.redis_conn.register_script(_BloomFilterBase.EXISTS_SCRIPT)
+        self._has_legacy = False
+        self._slices: List[Tuple[str, int, int, int]] = []
+        self._counts: List[int] = []
+        self._refreshed = False
+
+    def _slice(self, index: int) -> Tuple[str, int, int, int]:
+        """第 index 个分片的 (键, 位数, 哈希数, 容量)"""
+        capacity = int(self.capacity * self.growth ** index)
+        error_rate = self.error_rate * self.tightening ** index
+        num_bits = math.ceil(capacity * abs(math.log(error_rate)) / (math.log(2) ** 2))
+        num_hashes = math.ceil(num_bits * math.log(2) / capacity)
+        key = f"{self.name}:bitarray:dh" if index == 0 else f"{self.name}:bitarray:dh:{index}"
+        return key, num_bits, num_hashes, capacity
+
+    async def refresh(self):
+        """从 Redis 读取分片数与各分片写入数 (Reload slice metadata)"""
+        meta = await self.redis_conn.hgetall(self.meta_key)
+        meta = {k.decode() if isinstance(k, bytes) else k: int(v) for k, v in meta.items()}
+        slices = meta.get('slices', 1)
+        self._slices = [self._slice(i) for i in range(slices)]
+        self._counts = [meta.get(f'count:{i}', 0) for i in range(slices)]
+        if not self._refreshed:
+            self._has_legacy = bool(await self.redis_conn.exists(self.legacy.key))
+        self._refreshed = True
+
+    async def _legacy_exists(self, items: List) -> List[bool]:
+        if not self._has_legacy:
+            return [False] * len(items)
+        result = await self._legacy_script(keys=[self.legacy.key], args=self.legacy.args(items))
+        return [bool(existed) for existed in result]
+
+    def _args(self, items: List) -> List[int]:
+        _, _, _, capacity = self._slices[-1]
+        args = [len(self._slices), math.ceil(capacity * self.fill_ratio)]
+        args.extend(num_hashes for _, _, num_hashes, _ in self._slices)
+        for item in items:
+            if not isinstance(item, bytes):
+                item = str(item).encode('utf-8')
+            digest = hashlib.md5(item).digest()
+            h1 = int.from_bytes(digest[:8], 'big')
+            h2 = int.from_bytes(digest[8:], 'big') | 1
+            for _, num_bits, num_hashes, _ in self._slices:
+                args.extend((h1 + i * h2) % num_bits for i in range(num_hashes))
+        return args
+
+    async def add_many(self, items: Iterable) -> List[bool]:
+        """批量写入, 返回每个元素写入前是否不存在 (True for each item that was new)"""
+        items = list(items)
+        if not items:
+            return []
+        if not self._refreshed:
+            await self.refresh()
+        added = []
+        while len(added) < len(items):
+            keys = [self.meta_key] + [key for key, _, _, _ in self._slices]
+            result = await self._script(keys=keys, args=self._args(items[len(added):]))
+            if result and result[0] == -1:
+                # 其他进程新增了分片
+                await self.refresh()
+                continue
+            added.extend(not existed for existed in result)
+            self._counts[-1] += result.count(0)
+            if len(added) < len(items) or self._counts[-1] >= math.ceil(self._slices[-1][3] * self.fill_ratio):
+                # 当前分片已写满
+                await self.refresh()
+        return [new and not legacy for new, legacy in zip(added, await self._legacy_exists(items))]
+
+    async def add(self, item) -> bool:
+        return (await self.add_many([item]))[0]
+
+    async def add_if_absent(self, item) -> bool:
+        return await self.add(item)
+
+    async def exists_many(self, items: Iterable) -> List[bool]:
+        items = list(items)
+        if not items:
+            return []
+        if not self._refreshed:
+            await self.refresh()
+        pipe = self.redis_conn.pipeline(transaction=False)
+        for item in items:
+            positions = self._args([item])[2 + len(self._slices):]
+            for key, _, num_hashes, _ in self._slices:
+                for position in positions[:num_hashes]:
+                    pipe.getbit(key, position)
+                positions = positions[num_hashes:]
+        bits = await pipe.execute()
+        result = []
+        per_item = sum(num_hashes for _, _, num_hashes, _ in self._slices)
+        for i in range(len(items)):
+            offset = i * per_item
+            existed = False
+            for _, _, num_hashes, _ in self._slices:
+                if all(bits[offset:offset + num_hashes]):
+                    existed = True
+                    break
+                offset += num_hashes
+            result.append(existed)
+        return [existed or legacy for existed, legacy in zip(result, await self._legacy_exists(items))]
+
+    async def exists(self, item) -> bool:
+        return (await self.exists_many([item]))[0]
+
+    def stats(self) -> Dict:
+        """
+        最近一次同步时的分片数、当前分片填充率与估计误判率
+        (Slice count, fill ratio of the active slice and estimated false positive rate)
+        """
+        if not self._slices:
+            return {'slices': 0, 'fill': 0, 'fpr': 0}
+        miss = 1.0
+        for (_, num_bits, num_hashes, _), count in zip(self._slices, self._counts):
+            miss *= 1 - (1 - math.exp(-num_hashes * count / num_bits)) ** num_hashes
+        _, _, _, capacity = self._slices[-1]
+        return {
+            'slices': len(self._slices),
+            'items': sum(self._counts),
+            'fill': round(self._counts[-1] / capacity, 3),
+            'fpr': float(f'{1 - miss:.2e}'),
+        }
+
+
+class AsyncCuckooFilter:
+    """
+    按时间分代的布谷鸟过滤器, 支持删除与过期 (Time-bucketed cuckoo filter with deletion and expiry)
+
+    每 interval / generations 秒一代, 每代是一个 Redis 字符串, 每个桶4个16位指纹; 写入只进入当前代,
+    检查覆盖当前代与之前 generations 代, 因此元素写入 interval 秒后 (最多再晚一代) 会被重新接受,
+    旧的代由 Redis 过期自动删除。capacity 为每一代预计写入的元素数。
+    桶内位置与踢出均在 Lua 中完成, 一批元素的检查与写入在一次往返内原子完成
+    """
+    # KEYS: 各代 (新到旧), 当前代计数  ARGV: 桶数, 过期秒数, 最大踢出次数, 每个元素的 (指纹, 桶1)
+    _LIB = """
+    local nbuckets = tonumber(ARGV[1])
+    local ngen = #KEYS - 1
+    -- 备用桶 (h(fp) - i) mod n, 对两个桶互为备用
+    local function alt(i, fp)
+        return ((fp * 0x5bd1e995) % nbuckets - i) % nbuckets
+    end
+    local function pack(fp)
+        return string.char(fp % 256, math.floor(fp / 256))
+    end
+    local function slot_of(key, i, fp)
+        local bucket = redis.call('GETRANGE', key, i * 8, i * 8 + 7)
+        if #bucket < 8 then
+            return nil
+        end
+        for s = 0, 3 do
+            if bucket:byte(s * 2 + 1) + bucket:byte(s * 2 + 2) * 256 == fp then
+                return s
+            end
+        end
+        return nil
+    end
+    local function find(i1, fp)
+        local i2 = alt(i1, fp)
+        for g = 1, ngen do
+            local s = slot_of(KEYS[g], i1, fp)
+            if s then
+                return g, i1, s
+            end
+            s = slot_of(KEYS[g], i2, fp)
+            if s then
+                return g, i2, s
+            end
+        end
+        return nil
+    end
+    """
+    ADD_SCRIPT = _LIB + """
+    local ttl = tonumber(ARGV[2])
+    local max_kicks = tonumber(ARGV[3])
+    local key = KEYS[1]
+    if redis.call('EXISTS', key) == 0 then
+        redis.call('SETRANGE', key, nbuckets * 8 - 1, '\\0')
+        redis.call('EXPIRE', key, ttl)
+    end
+    local function put(i, s, fp)
+        redis.call('SETRANGE', key, i * 8 + s * 2, pack(fp))
+    end
+    local function insert(i1, fp)
+        local i = i1
+        for _, b in ipairs({i1, alt(i1, fp)}) do
+            local s = slot_of(key, b, 0)
+            if s then
+                put(b, s, fp)
+                return true
+            end
+            i = b
+        end
+        for _ = 1, max_kicks do
+            local s = math.random(0, 3)
+            local offset = i * 8 + s * 2
+            local bytes = redis.call('GETRANGE', key, offset, offset + 1)
+            local victim = bytes:byte(1) + bytes:byte(2) * 256
+            put(i, s, fp)
+            fp = victim
+            i = alt(i, fp)
+            local e = slot_of(key, i, 0)
+            if e then
+                put(i, e, fp)
+                return true
+            end
+        end
+        -- 桶已满, 最后被踢出的指纹丢失
+        return false
+    end
+    local result = {}
+    local added = 0
+    for n = 0, (#ARGV - 3) / 2 - 1 do
+        local fp = tonumber(ARGV[4 + n * 2])
+        local i1 = tonumber(ARGV[5 + n * 2])
+        if find(i1, fp) then
+            result[n + 1] = 1
+        else
+            result[n + 1] = insert(i1, fp) and 0 or 2
+            added = added + 1
+        end
+    end
+    local count = redis.call('INCRBY', KEYS[#KEYS], added)
+    redis.call('EXPIRE', KEYS[#KEYS], ttl)
+    result[#result + 1] = count
+    return result
+    """
+    EXISTS_SCRIPT = _LIB + """
+    local result = {}
+    for n = 0, (#ARGV - 3) / 2 - 1 do
+        result[n + 1] = find(tonumber(ARGV[5 + n * 2]), tonumber(ARGV[4 + n * 2])) and 1 or 0
+    end
+    return result
+    """
+    REMOVE_SCRIPT = _LIB + """
+    local result = {}
+    for n = 0, (#ARGV - 3) / 2 - 1 do
+        local g, i, s = find(tonumber(ARGV[5 + n * 2]), tonumber(ARGV[4 + n * 2]))
+        if g then
+            redis.call('SETRANGE', KEYS[g], i * 8 + s * 2, pack(0))
+            if g == 1 then
+                redis.call('DECR', KEYS[#KEYS])
+            end
+            result[n + 1] = 1
+        else
+            result[n + 1] = 0
+        end
+    end
+    return result
+    """
+
+    def __init__(self, redis_conn, name, capacity, interval, generations=4, max_kicks=500):
+        self.redis_conn = redis_conn
+        self.name = name
+        self.capacity = capacity
+        self.interval = interval
+        self.generations = generations
+        self.max_kicks = max_kicks
+        self.span = interval / generations
+        self.ttl = math.ceil(self.span * (generations + 1)) + 60
+        # 每桶4个槽位, 装载率不超过 95%
+        self.num_buckets = 1 << max(math.ceil(math.log2(capacity / 4 / 0.95)), 1)
+        self._add = self.redis_conn.register_script(self.ADD_SCRIPT)
+        self._exists = self.redis_conn.register_script(self.EXISTS_SCRIPT)
+        self._remove = self.redis_conn.register_script(self.REMOVE_SCRIPT)
+        self.count = 0
+        self.overflows = 0
+
+    def _keys(self) -> List[str]:
+        current = int(time.time() // self.span)
+        keys = [f"{self.name}:cuckoo:{g}" for g in range(current, current - self.generations - 1, -1)]
+        keys.append(f"{self.name}:cuckoo:{current}:count")
+        return keys
+
+    def _args(self, items: List) -> List[int]:
+        args = [self.num_buckets, self.ttl, self.max_kicks]
+        for item in items:
+            if not isinstance(item, bytes):
+                item = str(item).encode('utf-8')
+            digest = hashlib.md5(item).digest()
+            # 指纹0表示空槽位
+            args.append(int.from_bytes(digest[:2], 'big') % 65535 + 1)
+            args.append(int.from_bytes(digest[8:], 'big') & (self.num_buckets - 1))
+        return args
+
+    async def add_many(self, items: Iterable) -> List[bool]:
+        """批量写入, 返回每个元素写入前是否不存在 (True for each item that was new)"""
+        items = list(items)
+        if not items:
+            return []
+        *result, self.count = await self._add(keys=self._keys(), args=self._args(items))
+        self.overflows += result.count(2)
+        return [state != 1 for state in result]
+
+    async def add(self, item) -> bool:
+        return (await self.add_many([item]))[0]
+
+    async def add_if_absent(self, item) -> bool:
+        return await self.add(item)
+
+    async def exists_many(self, items: Iterable) -> List[bool]:
+        items = list(items)
+        if not items:
+            return []
+        return [bool(existed) for existed in await self._exists(keys=self._keys(), args=self._args(items))]
+
+    async def exists(self, item) -> bool:
+        return (await self.exists_many([item]))[0]
+
+    async def remove_many(self, items: Iterable) -> List[bool]:
+        """删除元素, 之后再次写入视为新元素 (Forget items so that they are accepted again)"""
+        items = list(items)
+        if not items:
+            return []
+        return [bool(removed) for removed in await self._remove(keys=self._keys(), args=self._args(items))]
+
+    async def remove(self, item) -> bool:
+        return (await self.remove_many([item]))[0]
+
+    def stats(self) -> Dict:
+        return {
+            'items': self.count,
+            'load': round(self.count / (self.num_buckets * 4), 3),
+            'overflows': self.overflows,
+        }
+
+
+class AsyncNamedQueue:
+    def __init__(self, redis_conn, name):
+        self.redis_conn = redis_conn
+        self.name = name
+
+    async def enqueue(self, item):
+        await self.redis_conn.lpush(self.name, item)
+
+    async def dequeue(self):
+        return await self.redis_conn.rpop(self.name)
+
+    async def size(self):
+        return await self.redis_conn.llen(self.name)
+
+    async def exists(self):
+        return await self.redis_conn.exists(self.name)
+
+    async def is_empty(self):
+        return await self.size() == 0
+
+
+class AsyncNamedList:
+    def __init__(self, redis_conn, name):
+        self.redis_conn = redis_conn
+        self.name = name
+
+    async def append(self, item):
+        await self.redis_conn.rpush(self.name, item)
+
+    async def prepend(self, item):
+        await self.redis_conn.lpush(self.name, item)
+
+    async def get(self, index):
+        return await self.redis_conn.lindex(self.name, index)
+
+    async def remove(self, item):
+        await self.redis_conn.lrem(self.name, 0, item)
+
+    async def size(self):
+        return await self.redis_conn.llen(self.name)
+
+    async def is_empty(self):
+        return await self.size() == 0
+
+    async def exists(self):
+        return await self.redis_conn.exists(self.name)
+
+    async def all(self):
+        return await self.redis_conn.lrange(self.name, 0, -1)
+
+
+class AsyncNamedSet:
+    def __init__(self, redis_conn, name):
+        self.redis_conn = redis_conn
+        self.name = name
+
+    async def add(self, item) -> bool:
+        return bool(await self.redis_conn.sadd(self.name, item))
+
+    async def contains(self, item) -> bool:
+        return bool(await self.redis_conn.sismember(self.name, item))
+
+    async def remove(self, item):
+        await self.redis_conn.srem(self.name, item)
+
+    async def size(self):
+        return await self.redis_conn.scard(self.name)
+
+    async def exists(self):
+        return await self.redis_conn.exists(self.name)
+
+
+class RedisFrontier:
+    """
+    多节点共享的任务队列, 批量操作均在一次往返内完成
+    (Shared task frontier with batched, single round trip operations)
+
+    lease 取出的任务在 visibility_timeout 秒内未 ack 会自动回到待处理队列, 节点崩溃不会丢失任务;
+    处理时间可能超过 visibility_timeout 的任务需定期 extend_many 续期, 否则会被其他节点重复处理
+    """
+    # KEYS: pending, leased, payload  ARGV: count, visibility_timeout
+    LEASE_SCRIPT = """
+    redis.replicate_commands()
+    local now = redis.call('TIME')
+    now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+    local count = tonumber(ARGV[1])
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now, 'LIMIT', 0, count)
+    for _, id in ipairs(expired) do
+        redis.call('ZREM', KEYS[2], id)
+        redis.call('LPUSH', KEYS[1], id)
+    end
+    local result = {}
+    local deadline = now + tonumber(ARGV[2])
+    for i = 1, count do
+        local id = redis.call('LPOP', KEYS[1])
+        if not id then
+            break
+        end
+        local data = redis.call('HGET', KEYS[3], id)
+        if data then
+            redis.call('ZADD', KEYS[2], deadline, id)
+            table.insert(result, id)
+            table.insert(result, data)
+        end
+    end
+    return result
+    """
+
+    # KEYS: leased  ARGV: visibility_timeout, 租约id...
+    # 只更新仍在租用中的任务, 已超时回到队列的不会重新加入, 返回续期成功的数量
+    EXTEND_SCRIPT = """
+    redis.replicate_commands()
+    local now = redis.call('TIME')
+    local deadline = tonumber(now[1]) + tonumber(now[2]) / 1000000 + tonumber(ARGV[1])
+    local extended = 0
+    for i = 2, #ARGV do
+        if redis.call('ZSCORE', KEYS[1], ARGV[i]) then
+            redis.call('ZADD', KEYS[1], 'XX', deadline, ARGV[i])
+            extended = extended + 1
+        end
+    end
+    return extended
+    """
+
+    def __init__(self, redis_conn, name, visibility_timeout=300):
+        self.redis_conn = redis_conn
+        self.name = name
+        self.visibility_timeout = visibility_timeout
+        self.pending_key = f"{self.name}:pending"
+        self.leased_key = f"{self.name}:leased"
+        self.payload_key = f"{self.name}:payload"
+        self._lease_script = self.redis_conn.register_script(self.LEASE_SCRIPT)
+        self._extend_script = self.redis_conn.register_script(self.EXTEND_SCRIPT)
+
+    def push_many(self, items: Iterable[Any]) -> List[str]:
+        mapping = {uuid.uuid4().hex: pickle.dumps(item) for item in items}
+        if not mapping:
+            return []
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.hset(self.payload_key, mapping=mapping)
+        pipe.rpush(self.pending_key, *mapping.keys())
+        pipe.execute()
+        return list(mapping.keys())
+
+    def push(self, item: Any) -> str:
+        return self.push_many([item])[0]
+
+    def lease(self, count: int = 100) -> List[Tuple[str, Any]]:
+        """
+        取出最多 count 个任务, 并先把超时未确认的任务放回队列
+        (Lease up to `count` items, requeueing expired leases first)
+        """
+        result = self._lease_script(keys=[self.pending_key, self.leased_key, self.payload_key],
+                                    args=[count, self.visibility_timeout])
+        leased = []
+        for i in range(0, len(result), 2):
+            lease_id = result[i].decode() if isinstance(result[i], bytes) else result[i]
+            leased.append((lease_id, pickle.loads(result[i + 1])))
+        return leased
+
+    def extend_many(self, lease_ids: List[str]) -> int:
+        """
+        把租约的超时时间延长到 visibility_timeout 秒后, 返回仍在租用中的数量
+        (Push the deadline of live leases visibility_timeout seconds out, returning how many were still held)
+        """
+        if not lease_ids:
+            return 0
+        return self._extend_script(keys=[self.leased_key], args=[self.visibility_timeout, *lease_ids])
+
+    def ack_many(self, lease_ids: List[str]):
+        if not lease_ids:
+            return
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.zrem(self.leased_key, *lease_ids)
+        pipe.hdel(self.payload_key, *lease_ids)
+        pipe.execute()
+
+    def ack(self, lease_id: str):
+        self.ack_many([lease_id])
+
+    def size(self):
+        return self.redis_conn.llen(self.pending_key)
+
+    def leased_size(self):
+        return self.redis_conn.zcard(self.leased_key)
+
+    def is_empty(self):
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.llen(self.pending_key)
+        pipe.zcard(self.leased_key)
+        pending, leased = pipe.execute()
+        return pending == 0 and leased == 0
@@ -10,39 +10,106 @@
 Change Log  :
 
 """
-import threading
-import time
+import asyncio
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional
 
+from fastspider.core.runtime import Component
 from fastspider.logger import logger
 
 
-class Monitor(threading.Thread):
+class Monitor(Component):
     n: int = 0
+    interval: int = 10
 
     def __init__(self):
-        super().__init__()
         self.total_urls = 0
         self.success_urls = 0
         self._last_success_urls = 0
         self.failed_urls = 0
         self._last_failed_urls = 0
-        self.errors = []
+        self.errors = deque(maxlen=100)
+        self.done_tasks = 0
+        self.dead_tasks = 0
+        self.cancelled_tasks = 0
         self.speed = 0
 
         self._running = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._reporter: Optional[Callable[[Dict], None]] = None
+        self._gauges: Dict[str, Callable[[], Dict]] = {}
 
     def stop(self):
+        """停止统计, 立即唤醒等待中的主循环 (Wake the report loop instead of waiting out the interval)"""
         self._running = False
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+
+    def register_gauge(self, name: str, gauge: Callable[[], Dict]):
+        """
+        注册一个运行状态指标, 在报告中输出 (Register a gauge printed with each report)
+
+        Args:
+            name: str: 指标名称
+            gauge: Callable: 返回指标字典的函数
+        """
+        self._gauges[name] = gauge
+
+    def gauges(self) -> Dict[str, Dict]:
+        return {name: gauge() for name, gauge in self._gauges.items()}
 
     def report(self):
-        return f'[失败:{self.failed_urls} | 成功:{self.success_urls} | 任务总数:{self.n} | 总请求数:{self.total_urls} | 速度:{self.speed}/s ]'
+        report = f'[失败:{self.failed_urls} | 成功:{self.success_urls} | 任务总数:{self.n} | 已完成任务:{self.done_tasks} | 死信任务:{self.dead_tasks} | 已取消任务:{self.cancelled_tasks} | 总请求数:{self.total_urls} | 速度:{self.speed}/s ]'
+        for name, values in self.gauges().items():
+            report += f'[{name}: ' + ' | '.join(f'{k}:{v}' for k, v in values.items()) + ' ]'
+        return report
+
+    def set_reporter(self, reporter: Callable[[Dict], None]):
+        """设置统计上报回调, 每个统计周期调用一次 (Called once per report interval)"""
+        self._reporter = reporter
+
+    def snapshot(self) -> Dict:
+        return {
+            'n': self.n,
+            'done_tasks': self.done_tasks,
+            'dead_tasks': self.dead_tasks,
+            'cancelled_tasks': self.cancelled_tasks,
+            'total_urls': self.total_urls,
+            'success_urls': self.success_urls,
+            'failed_urls': self.failed_urls,
+            'speed': self.speed,
+        }
+
+    def merge(self, snapshots: Iterable[Dict]):
+        """汇总多个进程的统计快照 (Aggregate snapshots from several processes)"""
+        snapshots = list(snapshots)
+        self.n = sum(s['n'] for s in snapshots)
+        self.done_tasks = sum(s['done_tasks'] for s in snapshots)
+        self.dead_tasks = sum(s.get('dead_tasks', 0) for s in snapshots)
+        self.cancelled_tasks = sum(s.get('cancelled_tasks', 0) for s in snapshots)
+        self.total_urls = sum(s['total_urls'] for s in snapshots)
+        self.success_urls = sum(s['success_urls'] for s in snapshots)
+        self.failed_urls = sum(s['failed_urls'] for s in snapshots)
+        self.speed = sum(s['speed'] for s in snapshots)
 
     def reset(self):
         self.total_urls = 0
         self.failed_urls = 0
         self.success_urls = 0
+        self.done_tasks = 0
+        self.dead_tasks = 0
+        self.cancelled_tasks = 0
         self.errors.clear()
 
+    def finish_task(self, success: bool = True, cancelled: bool = False):
+        if cancelled:
+            self.cancelled_tasks += 1
+        elif success:
+            self.done_tasks += 1
+        else:
+            self.dead_tasks += 1
+
     def update(self, success=True, error=None):
         self.total_urls += 1
         if success:
@@ -52,12 +119,20 @@ class Monitor(threading.Thread):
             if error:
                 self.errors.append(error)
 
-    def run(self):
+    async def run(self):
         self._running = True
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
         while self._running:
             self._last_success_urls = self.success_urls
-            time.sleep(10)
-            self.speed = (self.success_urls-self._last_success_urls) / 10
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), self.interval)
+                break
+            except asyncio.TimeoutError:
+                pass
+            self.speed = (self.success_urls-self._last_success_urls) / self.interval
             logger.debug(self.report())
+            if self._reporter:
+                self._reporter(self.snapshot())
 
 
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 """
-@Description: 
+@Description: 解析层
 @Date       : 2024/6/15 16:23
 @Author     : lkkings
 @FileName:  : __init__.py.py
@@ -10,3 +10,105 @@
 Change Log  :
 
 """
+import asyncio
+from asyncio import AbstractEventLoop
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Callable, Awaitable, Any, List, Set
+
+from fastspider.logger import logger
+
+
+def cpu_bound(func):
+    """
+    标记解析函数为CPU密集型 (Mark a parse function as CPU bound)
+
+    被标记的 parse 会被放入工作线程池中执行, 产出的数据在解析完成后统一送入存储
+    """
+    func.__cpu_bound__ = True
+    return func
+
+
+def is_cpu_bound(func) -> bool:
+    return getattr(func, '__cpu_bound__', False)
+
+
+def _drain(parse: Callable, text: str) -> List[Any]:
+    """在工作线程中使用独立的事件循环驱动异步生成器"""
+
+    async def _collect():
+        return [item async for item in parse(text)]
+
+    return asyncio.run(_collect())
+
+
+class Parser:
+    def __init__(self, cfg: Dict, loop: AbstractEventLoop = None) -> None:
+        cfg = cfg.get('crawler', {}).copy()
+        self._loop = loop or asyncio.get_event_loop()
+        self._parse_num = cfg['parse_thread_num']
+        # 解析结果按批交给 sink, 便于批量去重 (Items are handed to the sink in batches)
+        self._batch = cfg.get('parse_batch', 100)
+        self._semaphore = asyncio.Semaphore(self._parse_num)
+        self._executor = None
+        self._jobs: Set[asyncio.Task] = set()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._parse_num)
+        return self._executor
+
+    @property
+    def pending(self) -> int:
+        return len(self._jobs)
+
+    async def submit(self, crawler_task, text: str, sink: Callable[[Any, List[Any]], Awaitable[None]],
+                     done: Callable[[Any], None] = None):
+        """
+        提交一个解析任务, 并发数达到上限时挂起 (Submit a parse job, suspending when the limit is reached)
+
+        Args:
+            crawler_task: CrawlerTask: 爬虫任务
+            text: str: 页面内容
+            sink: Callable: 接收一批解析结果的协程函数
+            done: Callable: 解析结束后的回调, 无论成功与否
+        """
+        await self._semaphore.acquire()
+        job = self._loop.create_task(self._parse(crawler_task, text, sink, done))
+        self._jobs.add(job)
+        job.add_done_callback(self._jobs.discard)
+
+    async def _parse(self, crawler_task, text: str, sink: Callable[[Any, List[Any]], Awaitable[None]],
+                     done: Callable[[Any], None] = None):
+        try:
+            if is_cpu_bound(crawler_task.parse):
+                items = await self._loop.run_in_executor(self.executor, _drain, crawler_task.parse, text)
+                for i in range(0, len(items), self._batch):
+                    await sink(crawler_task, items[i:i + self._batch])
+            else:
+                batch = []
+                async for item in crawler_task.parse(text):
+                    batch.append(item)
+                    if len(batch) >= self._batch:
+                        await sink(crawler_task, batch)
+                        batch = []
+                if batch:
+                    await sink(crawler_task, batch)
+        except Exception as e:
+            logger.error(f'任务 {crawler_task.task_id} 解析失败：{e}')
+        finally:
+            self._semaphore.release()
+            if done:
+                done(crawler_task)
+
+    async def join(self):
+        """等待所有解析任务完成"""
+        if self._jobs:
+            await asyncio.gather(*self._jobs, return_exceptions=True)
+
+    def shutdown(self):
+        for job in self._jobs:
+            job.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -10,3 +10,104 @@
 Change Log  :
 
 """
+import heapq
+import itertools
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastspider.utils.queues import WatermarkQueue
+
+
+class Scheduler:
+    """
+    优先级调度器 (Priority scheduler with per-domain round-robin)
+
+    优先级数值越小越先出队; 优先级相同的域名轮流出队, 单个域名的大量任务不会饿死其他域名。
+    每个域名一个任务堆, 另有一个域名就绪堆, 入队出队均为 O(log n)。
+    """
+
+    def __init__(self):
+        # domain -> [(priority, seq, task)]
+        self._domains: Dict[str, List[Tuple[int, int, Any]]] = {}
+        # [(priority, turn, domain)], turn 与 _tokens 不一致的为过期项
+        self._ready: List[Tuple[int, int, str]] = []
+        self._tokens: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._turn = itertools.count()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def domains(self) -> int:
+        return len(self._domains)
+
+    def _schedule(self, domain: str, priority: int):
+        turn = next(self._turn)
+        self._tokens[domain] = turn
+        heapq.heappush(self._ready, (priority, turn, domain))
+
+    def push(self, task: Any, priority: int = 0, domain: str = ''):
+        heap = self._domains.get(domain)
+        entry = (priority, next(self._seq), task)
+        if heap is None:
+            self._domains[domain] = [entry]
+            self._schedule(domain, priority)
+        else:
+            head = heap[0][0]
+            heapq.heappush(heap, entry)
+            if priority < head:
+                # 域名出现更高优先级的任务, 重新排入就绪堆, 旧的就绪项过期
+                self._schedule(domain, priority)
+        self._size += 1
+
+    def pop(self) -> Any:
+        while self._ready:
+            priority, turn, domain = heapq.heappop(self._ready)
+            if self._tokens.get(domain) != turn:
+                continue
+            heap = self._domains[domain]
+            _, _, task = heapq.heappop(heap)
+            self._size -= 1
+            if heap:
+                # 排到同优先级其他域名之后
+                self._schedule(domain, heap[0][0])
+            else:
+                del self._domains[domain]
+                del self._tokens[domain]
+            return task
+        raise IndexError('pop from an empty scheduler')
+
+
+class PriorityTaskQueue(WatermarkQueue):
+    """
+    基于 Scheduler 的任务队列, 任务需提供 priority 与 domain 属性
+    (Watermark queue ordered by Scheduler; None control markers are returned first)
+    """
+
+    def _init(self, maxsize):
+        self._queue = Scheduler()
+        self._control = deque()
+
+    def _put(self, item):
+        if item is None:
+            self._control.append(item)
+        else:
+            self._queue.push(item, item.priority, item.domain)
+
+    def _get(self):
+        if self._control:
+            return self._control.popleft()
+        return self._queue.pop()
+
+    def qsize(self) -> int:
+        return len(self._queue) + len(self._control)
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats['domains'] = self._queue.domains
+        return stats
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 延迟队列
+@Date       : 2024/6/29 10:18
+@Author     : lkkings
+@FileName:  : delay.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastspider.core.runtime import Component
+
+
+def backoff(attempt: int, base: float = 1.0, cap: float = 60.0, retry_after: Optional[float] = None) -> float:
+    """
+    带抖动的指数退避时间, 服务端给出 Retry-After 时不早于该时间
+    (Full-jitter exponential backoff, never shorter than Retry-After)
+
+    Args:
+        attempt: int: 第几次重试, 从1开始
+        base: float: 基础等待秒数
+        cap: float: 最长等待秒数
+        retry_after: float: 服务端要求的等待秒数
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** max(attempt - 1, 0)))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class DelayQueue(Component):
+    """
+    基于最小堆的延迟队列, 到期的元素交给 release 回调
+    (Heap based delay queue handing due items to `release`)
+    """
+
+    def __init__(self, release: Callable[[Any], None]):
+        self._release = release
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._running = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, item: Any, delay: float):
+        due = time.monotonic() + delay
+        # 新元素早于当前最早到期时间时唤醒等待
+        if not self._heap or due < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (due, next(self._seq), item))
+
+    async def run(self):
+        self._running = True
+        while self._running:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, item = heapq.heappop(self._heap)
+                self._release(item)
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def stats(self) -> Dict:
+        return {'depth': len(self._heap)}
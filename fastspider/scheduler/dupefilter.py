@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 抓取前的请求去重
+@Date       : 2024/7/2 09:15
+@Author     : lkkings
+@FileName:  : dupefilter.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastspider.utils.bloom_filter import BloomFilter
+
+# 指纹按最高8位分片, 扩容时只重排一个分片, 避免长时间停顿
+_SHARD_BITS = 8
+_SHARDS = 1 << _SHARD_BITS
+
+
+class FingerprintSet:
+    """
+    64位指纹集合, 开放寻址线性探测, 每个槽位8字节 (Open addressing set of non-zero 64-bit fingerprints)
+
+    内存约为 8 * n / 装载率 字节, 默认最大装载率0.9、扩容1.25倍, 平均约 10 字节/指纹;
+    预计数量已知时用 capacity 预分配, 1亿指纹约占用 0.9GB
+    """
+
+    def __init__(self, capacity: int = 1 << 20, max_load: float = 0.9, growth: float = 1.25):
+        self.max_load = max_load
+        self.growth = growth
+        per_shard = max(int(capacity / max_load / _SHARDS) + 1, 8)
+        self._tables: List[array] = [array('Q', bytes(8 * per_shard)) for _ in range(_SHARDS)]
+        self._sizes: List[int] = [0] * _SHARDS
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, fp: int) -> bool:
+        table = self._tables[fp >> (64 - _SHARD_BITS)]
+        capacity = len(table)
+        index = fp % capacity
+        while True:
+            slot = table[index]
+            if slot == fp:
+                return True
+            if slot == 0:
+                return False
+            index += 1
+            if index == capacity:
+                index = 0
+
+    def add(self, fp: int) -> bool:
+        """加入指纹, 返回是否为新指纹 (Returns True if the fingerprint was not present)"""
+        shard = fp >> (64 - _SHARD_BITS)
+        table = self._tables[shard]
+        capacity = len(table)
+        index = fp % capacity
+        while True:
+            slot = table[index]
+            if slot == fp:
+                return False
+            if slot == 0:
+                break
+            index += 1
+            if index == capacity:
+                index = 0
+        table[index] = fp
+        self._sizes[shard] += 1
+        self._size += 1
+        if self._sizes[shard] > capacity * self.max_load:
+            self._resize(shard)
+        return True
+
+    def _resize(self, shard: int):
+        old = self._tables[shard]
+        capacity = int(len(old) * self.growth) + 1
+        table = array('Q', bytes(8 * capacity))
+        for fp in old:
+            if fp:
+                index = fp % capacity
+                while table[index]:
+                    index += 1
+                    if index == capacity:
+                        index = 0
+                table[index] = fp
+        self._tables[shard] = table
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(table) * table.itemsize for table in self._tables)
+
+
+class DupeFilter:
+    """
+    抓取前的请求指纹去重 (Request fingerprint dedup before fetching)
+
+    指纹保存在进程内的 FingerprintSet 中; 设置 spill (AsyncNamedSet) 后本地指纹数达到 max_local,
+    之后的新指纹写入 Redis 集合, 本地内存不再增长
+    """
+
+    def __init__(self, cfg: Dict):
+        cfg = cfg.get('fingerprint', {})
+        self.enable: bool = cfg.get('enable', False)
+        self.max_local: int = cfg.get('max_local', 100_000_000)
+        self._local = FingerprintSet(cfg.get('capacity', 1 << 20), cfg.get('max_load', 0.9)) if self.enable else None
+        self.spill = None
+        self.duplicates = 0
+
+    async def seen(self, fp: Optional[int]) -> bool:
+        """记录指纹, 返回是否已经出现过 (Record the fingerprint and tell whether it was seen before)"""
+        if not self.enable or fp is None:
+            return False
+        if fp in self._local:
+            self.duplicates += 1
+            return True
+        if self.spill is not None and len(self._local) >= self.max_local:
+            added = await self.spill.add(fp)
+            if not added:
+                self.duplicates += 1
+            return not added
+        self._local.add(fp)
+        return False
+
+    def stats(self) -> Dict:
+        return {
+            'size': len(self._local),
+            'duplicates': self.duplicates,
+            'memory_mb': round(self._local.nbytes / 1024 / 1024, 1),
+        }
+
+
+class TieredFilter:
+    """
+    两级去重过滤器, 本地层挡住进程内的重复, 只有本地未命中的元素才访问共享的远程过滤器
+    (Two-tier filter: a local tier answers hot repeats, misses go to the shared remote filter)
+
+    本地层只记录已写入远程的元素, 本地命中必然也是远程重复, 多节点下结果与只用远程过滤器一致;
+    本地未命中的元素写入远程后再写入本地 (write-through)。同一轮事件循环内的单条调用合并为一次批量请求。
+    本地层为 lru 时精确、按最近使用淘汰; 为 bloom 时内存更省, 但会叠加 error_rate 的误判。
+    远程过滤器会过期时设置 ttl: 本地只缓存本次新写入的元素, 写入 ttl 秒后不再命中, bloom 每 ttl 秒清空一次
+
+    Args:
+        remote: 远程过滤器, 需实现 add_many / exists_many
+        cfg: dict: bloom.local 配置
+        ttl: float: 本地记录的有效秒数, 不超过远程过滤器遗忘元素的时间
+    """
+
+    def __init__(self, remote, cfg: Dict, ttl: float = None):
+        self.remote = remote
+        self.ttl = ttl
+        self.kind: str = cfg.get('kind', 'lru')
+        self.size: int = cfg.get('size', 1_000_000)
+        self.max_batch: int = cfg.get('max_batch', 500)
+        if self.kind == 'bloom':
+            self._bloom = BloomFilter(self.size, cfg.get('error_rate', 0.0001))
+            self._bloom_since = time.monotonic()
+        else:
+            self._lru: 'OrderedDict[str, float]' = OrderedDict()
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self.local_hits = 0
+        self.remote_calls = 0
+        self.remote_items = 0
+
+    def _local_contains(self, item) -> bool:
+        if self.kind == 'bloom':
+            if self.ttl and time.monotonic() - self._bloom_since >= self.ttl:
+                self._bloom.clear()
+                self._bloom_since = time.monotonic()
+            return self._bloom.contains(item)
+        added_at = self._lru.get(item)
+        if added_at is None:
+            return False
+        if self.ttl and time.monotonic() - added_at >= self.ttl:
+            del self._lru[item]
+            return False
+        self._lru.move_to_end(item)
+        return True
+
+    def _local_add(self, items: Iterable):
+        if self.kind == 'bloom':
+            self._bloom.add_many(items)
+            return
+        now = time.monotonic()
+        for item in items:
+            self._lru[item] = now
+            self._lru.move_to_end(item)
+        while len(self._lru) > self.size:
+            self._lru.popitem(last=False)
+
+    async def add_many(self, items: Iterable) -> List[bool]:
+        """批量写入, 返回每个元素写入前是否不存在 (True for each item that was new)"""
+        items = [str(item) for item in items]
+        result = [False] * len(items)
+        misses = []
+        for i, item in enumerate(items):
+            if self._local_contains(item):
+                self.local_hits += 1
+            else:
+                misses.append(i)
+        if misses:
+            keys = [items[i] for i in misses]
+            self.remote_calls += 1
+            self.remote_items += len(keys)
+            for i, added in zip(misses, await self.remote.add_many(keys)):
+                result[i] = added
+            # 会过期时已存在的元素不知道写入时间, 不缓存
+            self._local_add([items[i] for i in misses if result[i]] if self.ttl else keys)
+        return result
+
+    async def add(self, item) -> bool:
+        """单条写入, 同一轮事件循环内的调用合并为一次 add_many (Single adds are batched per loop tick)"""
+        item = str(item)
+        if self._local_contains(item):
+            self.local_hits += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if self._flush_task is None:
+            # 任务在下一轮事件循环才开始执行, 本轮的单条调用都会进入同一批
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush())
+        return await future
+
+    async def _flush(self):
+        batch = []
+        try:
+            while self._pending:
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+                try:
+                    added = await self.add_many([item for item, _ in batch])
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), new in zip(batch, added):
+                    if not future.done():
+                        future.set_result(new)
+        except asyncio.CancelledError:
+            # 等待中的调用不能永远挂起
+            for _, future in batch + self._pending:
+                future.cancel()
+            self._pending = []
+            raise
+        finally:
+            self._flush_task = None
+
+    async def add_if_absent(self, item) -> bool:
+        return await self.add(item)
+
+    async def exists_many(self, items: Iterable) -> List[bool]:
+        items = [str(item) for item in items]
+        result = [self._local_contains(item) for item in items]
+        misses = [i for i, hit in enumerate(result) if not hit]
+        self.local_hits += len(items) - len(misses)
+        if misses:
+            self.remote_calls += 1
+            self.remote_items += len(misses)
+            for i, existed in zip(misses, await self.remote.exists_many([items[i] for i in misses])):
+                result[i] = existed
+        return result
+
+    async def exists(self, item) -> bool:
+        return (await self.exists_many([item]))[0]
+
+    async def remove_many(self, items: Iterable) -> List[bool]:
+        """从两级中删除元素, 远程过滤器需支持删除 (Requires a remote filter that supports deletion)"""
+        items = [str(item) for item in items]
+        if self.kind == 'bloom':
+            self._bloom.clear()
+        else:
+            for item in items:
+                self._lru.pop(item, None)
+        return await self.remote.remove_many(items)
+
+    async def remove(self, item) -> bool:
+        return (await self.remove_many([item]))[0]
+
+    async def close(self):
+        """等待未完成的批量写入后关闭远程过滤器 (Wait for the in-flight batch, then close the remote filter)"""
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        close = getattr(self.remote, 'close', None)
+        if close:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+
+    def stats(self) -> Dict:
+        stats = {
+            'local_hits': self.local_hits,
+            'remote_calls': self.remote_calls,
+            'remote_items': self.remote_items,
+            'local_size': len(self._bloom) if self.kind == 'bloom' else len(self._lru),
+        }
+        if hasattr(self.remote, 'stats'):
+            stats.update(self.remote.stats())
+        return stats
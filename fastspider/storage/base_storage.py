@@ -1,61 +1,210 @@
-import threading
+import asyncio
 import time
-import traceback
-from abc import ABC, abstractmethod
-from typing import List
+from abc import abstractmethod
+from typing import Dict, Iterable, List, Optional
 
 from fastspider import Item
+from fastspider.core.runtime import Component
 from fastspider.logger import logger
+from fastspider.scheduler.delay import backoff
+from fastspider.utils.queues import WatermarkQueue
 
 
-class BaseStorage(ABC, threading.Thread):
+class BaseStorage(Component):
+    """
+    批量写入的存储组件 (Batched storage writer)
+
+    数据经 add 进入有界的接收队列, 队列达到高水位时 add 挂起; 主循环按 batch_size 条或最早一条等待
+    max_latency 秒组成一批, 交给 workers 个写入协程并行写入, 写入失败按指数退避重试 retry.max 次。
+    同步驱动实现 _save, 在线程池中执行; 原生异步驱动直接重写 _asave。
+    部分写入失败时二者返回失败的数据, 只重试这些数据
+    """
     collection: str = ''
+    interval: float = 0.3
 
-    def __init__(self):
-        super().__init__()
-        self._p = 0
-        self._temp_size = 100
-        self._temp_ = []
+    def __init__(self, cfg: Dict = None):
+        cfg = cfg or {}
+        self.batch_size: int = cfg.get('batch_size', 100)
+        self.max_latency: float = cfg.get('max_latency', self.interval)
+        self.workers: int = cfg.get('workers', 1)
+        retry_cfg = cfg.get('retry', {})
+        self.max_retries: int = retry_cfg.get('max', 5)
+        self.retry_base: float = retry_cfg.get('base', 0.5)
+        self.retry_cap: float = retry_cfg.get('cap', 30)
+        # 接收队列水位线, 达到高水位后 add 挂起直到写入到低水位以下
+        self._queue = WatermarkQueue.from_cfg(cfg.get('buffer'), high=self.batch_size * 10)
+        # 待写入的批次, 容量等于写入协程数, 写入跟不上时主循环在此等待
+        self._batches: asyncio.Queue = asyncio.Queue(maxsize=self.workers)
+        self._arrived = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._oldest = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
         self.running = False
+        self.written = 0
+        self.failed = 0
+        self.retried = 0
+        self._rate_written = 0
+        self._rate_at = time.monotonic()
 
     @abstractmethod
     def init(self):
         pass
 
-    def add(self, item: Item):
-        self._temp_.append(item)
-        self._p += 1
+    async def add(self, item: Item):
+        """添加数据, 接收队列达到高水位时挂起 (Suspends while the ingest queue is above its high watermark)"""
+        await self._queue.put(item)
+        size = self._queue.qsize()
+        if size == 1:
+            self._oldest = time.monotonic()
+            self._arrived.set()
+        elif size >= self.batch_size:
+            self._arrived.set()
+
+    async def add_many(self, items: Iterable[Item]):
+        for item in items:
+            await self.add(item)
+
+    async def put(self, item: Item):
+        await self.add(item)
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        elapsed = now - self._rate_at
+        rate = (self.written - self._rate_written) / elapsed if elapsed > 0 else 0
+        self._rate_written, self._rate_at = self.written, now
+        return {
+            **self._queue.stats(),
+            'written': self.written,
+            'failed': self.failed,
+            'retried': self.retried,
+            'rate': round(rate, 1),
+        }
 
     def stop(self):
+        """通知主循环写完剩余数据后退出, 可在其他线程或信号处理中调用"""
         self.running = False
-        if len(self._temp_) > 0:
-            self.save()
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._arrived.set)
+        elif self._queue.qsize():
+            # 事件循环已结束, 同步写入残留数据
+            items = [self._queue.get_nowait() for _ in range(self._queue.qsize())]
+            try:
+                failed = self._save(items) or []
+            except Exception as e:
+                failed = items
+                logger.error(f'保存失败：{e}')
+            self.written += len(items) - len(failed)
+            if failed:
+                self.failed += len(failed)
+                logger.error(f'{len(failed)}条数据已丢弃')
 
-    @abstractmethod
-    def _save(self, items: List[Item]):
-        raise NotImplemented
+    async def setup(self):
+        self._loop = asyncio.get_running_loop()
+        await self._loop.run_in_executor(None, self.init)
 
-    def save(self):
-        try:
-            self._save(self._temp_)
-            self._p = 0
-            self._temp_.clear()
-        except Exception as e:
-            traceback.print_exc()
-            logger.error(f'保存失败 {e}')
+    async def teardown(self):
+        # Runtime 等待超时后仍要保证已接收的数据全部写入
+        await self._drained.wait()
+        self._loop = None
+
+    def _save(self, items: List[Item]) -> Optional[List[Item]]:
+        """
+        同步写入一批数据, 在线程池中执行, 返回写入失败需要重试的数据
+        (Write a batch synchronously in a worker thread, returning the items to retry)
+        """
+        raise NotImplementedError
+
+    async def _asave(self, items: List[Item]) -> Optional[List[Item]]:
+        """写入一批数据, 原生异步驱动重写此方法 (Native async drivers override this)"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._save, items)
 
     def all(self):
         raise NotImplemented
 
-    def run(self):
-        self.init()
+    async def _write(self, items: List[Item]):
+        start = time.monotonic()
+        pending = items
+        for attempt in range(1, self.max_retries + 2):
+            try:
+                failed = await self._asave(pending) or []
+                error = f'{len(failed)}条写入失败'
+            except Exception as e:
+                failed, error = pending, e
+            self.written += len(pending) - len(failed)
+            if not failed:
+                break
+            if attempt > self.max_retries:
+                self.failed += len(failed)
+                logger.error(f'保存失败, {len(failed)}条数据已丢弃：{error}')
+                break
+            pending = failed
+            self.retried += 1
+            delay = backoff(attempt, self.retry_base, self.retry_cap)
+            logger.warning(f'保存失败, {delay:.2f}s 后第{attempt}次重试{len(pending)}条：{error}')
+            await asyncio.sleep(delay)
+        elapsed = time.monotonic() - start
+        logger.debug(f'{len(items)}条 | 速度 {len(items) / elapsed if elapsed else 0:.0f}/s')
+
+    async def _worker(self):
+        while True:
+            items = await self._batches.get()
+            if items is None:
+                return
+            try:
+                await self._write(items)
+            except Exception as e:
+                # 写入协程不能退出, 否则主循环会阻塞在待写入批次上
+                self.failed += len(items)
+                logger.error(f'保存失败, {len(items)}条数据已丢弃：{e}')
+
+    def _ready(self) -> bool:
+        size = self._queue.qsize()
+        if size >= self.batch_size or (size and not self.running):
+            return True
+        return size > 0 and time.monotonic() - self._oldest >= self.max_latency
+
+    async def run(self):
         self.running = True
-        _start_time = time.time()
-        while self.running:
-            time.sleep(0.3)
-            if self._p > self._temp_size:
-                n = len(self._temp_)
-                _end_time = time.time()
-                logger.debug(f'{n}条 | 速度 {n / (_end_time - _start_time)}/s')
-                self.save()
-                _start_time = time.time()
+        self._drained.clear()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        items = None
+        try:
+            while self.running or self._queue.qsize():
+                if not self._ready():
+                    self._arrived.clear()
+                    timeout = self.max_latency
+                    if self._queue.qsize():
+                        timeout = max(self._oldest + self.max_latency - time.monotonic(), 0)
+                    try:
+                        await asyncio.wait_for(self._arrived.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                items = [self._queue.get_nowait() for _ in range(min(self._queue.qsize(), self.batch_size))]
+                if self._queue.qsize():
+                    self._oldest = time.monotonic()
+                await self._batches.put(items)
+                items = None
+        finally:
+            # Runtime 超时取消主循环时, 已接收但未成批的数据也要交给写入协程
+            try:
+                if items:
+                    await self._batches.put(items)
+                    items = None
+                while self._queue.qsize():
+                    items = [self._queue.get_nowait() for _ in range(min(self._queue.qsize(), self.batch_size))]
+                    await self._batches.put(items)
+                    items = None
+                for _ in workers:
+                    await self._batches.put(None)
+                await asyncio.gather(*workers)
+            except asyncio.CancelledError:
+                lost = len(items or []) + self._queue.qsize() + sum(
+                    len(batch) for batch in self._batches._queue if batch)
+                if lost:
+                    self.failed += lost
+                    logger.error(f'存储被强制停止, {lost}条数据未写入')
+                raise
+            finally:
+                self._drained.set()
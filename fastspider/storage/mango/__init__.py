@@ -1,4 +1,4 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from fastspider import Item
 from fastspider.storage.base_storage import BaseStorage
@@ -9,18 +9,23 @@ class MangoDB(BaseStorage):
     client: MongoDBWrapper
 
     def __init__(self, cfg: Dict) -> None:
-        super().__init__()
+        super().__init__(cfg)
         self.cfg = cfg.get('mongodb',{}).copy()
         self._collection = None
 
     def init(self):
         mongo_uri = self.cfg['uri']
         database = self.cfg['database']
-        self.client = MongoDBWrapper(uri=mongo_uri, database_name=database)
+        # 各写入协程在线程池中并发写入, 共享同一个连接池
+        pool_size = self.cfg.get('max_pool_size', max(self.workers * 2, 10))
+        self.client = MongoDBWrapper(uri=mongo_uri, database_name=database, max_pool_size=pool_size)
 
     def all(self):
         return super().all()
 
-    def _save(self, items: List[Item]):
-        items = [dict(item) for item in items]
-        self.client.insert_many(collection_name=self.collection, documents=items)
+    def _save(self, items: List[Item]) -> Optional[List[Item]]:
+        """按 UniqueItem.id upsert, 重复写入幂等, 返回写入失败需要重试的数据"""
+        documents = [dict(item) for item in items]
+        failed = self.client.bulk_upsert(collection_name=self.collection, documents=documents,
+                                         key=self.cfg.get('key', 'id'))
+        return [items[i] for i in failed]
@@ -1,20 +1,24 @@
-from pymongo import MongoClient
-from pymongo.errors import OperationFailure
+from typing import Dict, List
+
+from pymongo import InsertOne, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 
 from fastspider.logger import logger
 
 
 class MongoDBWrapper:
-    def __init__(self, uri, database_name):
+    def __init__(self, uri, database_name, max_pool_size=100):
         self.uri = uri
         self.database_name = database_name
+        self.max_pool_size = max_pool_size
         self.client = None
         self.db = None
         self._connect()
 
     def _connect(self):
         try:
-            self.client = MongoClient(self.uri)
+            # 客户端线程安全, 多个写入线程共享同一个连接池
+            self.client = MongoClient(self.uri, maxPoolSize=self.max_pool_size)
             self.db = self.client[self.database_name]
             logger.info(f"Connected to MongoDB database: {self.database_name}")
         except ConnectionError as e:
@@ -37,6 +41,26 @@ class MongoDBWrapper:
         except OperationFailure as e:
             raise e
 
+    def bulk_upsert(self, collection_name, documents: List[Dict], key: str = 'id') -> List[int]:
+        """
+        无序批量写入, 带 key 的文档按 key upsert, 其余直接插入, 返回写入失败的文档下标
+        (Unordered bulk write upserting on `key`, returns the indexes of failed documents)
+
+        无序写入时单个文档失败不影响其余文档, 按 key upsert 使重复写入幂等
+        """
+        requests = [
+            UpdateOne({key: doc[key]}, {'$set': doc}, upsert=True) if doc.get(key) is not None else InsertOne(doc)
+            for doc in documents
+        ]
+        try:
+            self.db[collection_name].bulk_write(requests, ordered=False)
+            return []
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            for error in errors[:3]:
+                logger.warning(f"Bulk write error on {collection_name}: {error.get('code')} {error.get('errmsg')}")
+            return sorted({error['index'] for error in errors})
+
     def find_one(self, collection_name, query):
         try:
             collection = self.db[collection_name]
@@ -10,6 +10,19 @@
 import threading
 
 
+def _freeze(value):
+    """把参数转换为可哈希的形式, 配置字典作为参数时按内容区分实例"""
+    if isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _make_key(cls, args, kwargs):
+    return cls, _freeze(args), _freeze(kwargs)
+
+
 class Singleton(type):
     _instances = {}  # 存储实例的字典
     _lock: threading.Lock = threading.Lock()  # 线程锁
@@ -22,7 +35,7 @@ class Singleton(type):
         重写默认的类实例化方法。当尝试创建类的一个新实例时，此方法将被调用。
         如果已经有一个与参数匹配的实例存在，则返回该实例；否则创建一个新实例。
         """
-        key = (cls, args, frozenset(kwargs.items()))
+        key = _make_key(cls, args, kwargs)
         with cls._lock:
             if key not in cls._instances:
                 instance = super().__call__(*args, **kwargs)
@@ -35,7 +48,7 @@ class Singleton(type):
         重置指定参数的实例。这只是从 _instances 字典中删除实例的引用，
         并不真正删除该实例。如果其他地方仍引用该实例，它仍然存在且可用。
         """
-        key = (cls, args, frozenset(kwargs.items()))
+        key = _make_key(cls, args, kwargs)
         with cls._lock:
             if key in cls._instances:
                 del cls._instances[key]
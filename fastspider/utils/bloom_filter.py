@@ -1,37 +1,230 @@
+import hashlib
 import math
-import mmh3  # 需要安装 mmh3 库，可以通过 pip 安装
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import numpy as np  # 可选依赖, 安装后批量计算位置与读写位数组
+except ImportError:
+    np = None
+
+_MASK = (1 << 64) - 1
+# 文件头: 魔数, 版本, 哈希数, 位数, 容量, 误判率, 已写入数; 之后是位数组
+_HEADER = struct.Struct('<4sHHQQdQ')
+_HEADER_SIZE = 64
+_MAGIC = b'FSBF'
+_VERSION = 1
 
 
 class BloomFilter:
-    def __init__(self, capacity, error_rate=0.01):
+    """
+    进程内布隆过滤器, 位数组按位打包, 1亿元素、1%误判率约占用 114MB
+    (In-process Bloom filter over a packed bit array)
+
+    与 Redis 布隆过滤器相同, 由 md5 的前后两半做双重哈希得到 num_hashes 个位置; 安装 numpy 后
+    add_many / contains_many 一次计算整批位置。指定 path 时位数组映射到文件, 重启后直接打开, 无需重建
+
+    Args:
+        capacity: int: 预计元素数
+        error_rate: float: 误判率
+        path: str: 持久化文件, 已存在时沿用文件中的参数
+    """
+
+    def __init__(self, capacity, error_rate=0.01, path: Optional[str] = None):
         self.capacity = capacity
         self.error_rate = error_rate
         self.bit_array_size = self.calculate_bit_array_size()
         self.num_hashes = self.calculate_num_hashes()
-        self.bit_array = [False] * self.bit_array_size
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._mmap = None
+        if path:
+            self._open(path)
+        else:
+            self.bit_array = bytearray(self.bit_array_size // 8)
+        self._bits = np.frombuffer(self.bit_array, dtype=np.uint8) if np is not None else None
 
     def calculate_bit_array_size(self):
         m = -(self.capacity * math.log(self.error_rate)) / (math.log(2) ** 2)
-        return int(m)
+        # 按字节对齐
+        return max(math.ceil(m / 8), 1) * 8
 
     def calculate_num_hashes(self):
         k = (self.bit_array_size / self.capacity) * math.log(2)
-        return int(k)
+        return max(round(k), 1)
+
+    def _open(self, path: str):
+        size = _HEADER_SIZE + self.bit_array_size // 8
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION, self.num_hashes, self.bit_array_size,
+                                     self.capacity, self.error_rate, 0).ljust(_HEADER_SIZE, b'\0'))
+                f.truncate(size)
+        self._file = open(path, 'r+b')
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        magic, version, num_hashes, num_bits, capacity, error_rate, count = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC or version != _VERSION:
+            self._mmap.close()
+            self._file.close()
+            raise ValueError(f'{path} 不是布隆过滤器文件')
+        self.num_hashes, self.bit_array_size = num_hashes, num_bits
+        self.capacity, self.error_rate, self.count = capacity, error_rate, count
+        self.bit_array = memoryview(self._mmap)[_HEADER_SIZE:_HEADER_SIZE + num_bits // 8]
+
+    def _hashes(self, items: List):
+        digests = []
+        for item in items:
+            if not isinstance(item, bytes):
+                item = str(item).encode('utf-8')
+            digests.append(hashlib.md5(item).digest())
+        return digests
+
+    def _positions(self, digests: List[bytes]):
+        """
+        每个元素的 num_hashes 个位置, (h1 + i * h2) mod 2^64 mod m, 有 numpy 时返回 (n, k) 数组
+        """
+        m, k = self.bit_array_size, self.num_hashes
+        if self._bits is not None:
+            hashes = np.frombuffer(b''.join(digests), dtype='>u8').astype(np.uint64).reshape(-1, 2)
+            h1, h2 = hashes[:, :1], hashes[:, 1:] | np.uint64(1)
+            # uint64 运算自然按 2^64 回绕, 与纯 Python 分支结果一致
+            with np.errstate(over='ignore'):
+                return (h1 + np.arange(k, dtype=np.uint64) * h2) % np.uint64(m)
+        positions = []
+        for digest in digests:
+            h1 = int.from_bytes(digest[:8], 'big')
+            h2 = int.from_bytes(digest[8:], 'big') | 1
+            positions.append([((h1 + i * h2) & _MASK) % m for i in range(k)])
+        return positions
+
+    def _test(self, positions) -> List[bool]:
+        if self._bits is not None:
+            bits = (self._bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+            return bits.all(axis=1).tolist()
+        bit_array = self.bit_array
+        return [all(bit_array[p >> 3] >> (p & 7) & 1 for p in row) for row in positions]
+
+    def add_many(self, items: Iterable) -> List[bool]:
+        """
+        批量写入, 返回每个元素写入前是否不存在 (True for each item that was new)
+
+        同一批内重复的元素只有第一个返回 True
+        """
+        items = list(items)
+        if not items:
+            return []
+        digests = self._hashes(items)
+        positions = self._positions(digests)
+        added = [not existed for existed in self._test(positions)]
+        seen = set()
+        for i, digest in enumerate(digests):
+            if added[i]:
+                if digest in seen:
+                    added[i] = False
+                seen.add(digest)
+        if self._bits is not None:
+            rows = positions[np.array(added)]
+            np.bitwise_or.at(self._bits, rows >> np.uint64(3),
+                             np.left_shift(1, rows & np.uint64(7)).astype(np.uint8))
+        else:
+            bit_array = self.bit_array
+            for row, new in zip(positions, added):
+                if new:
+                    for p in row:
+                        bit_array[p >> 3] |= 1 << (p & 7)
+        self.count += sum(added)
+        if self._mmap is not None:
+            _HEADER.pack_into(self._mmap, 0, _MAGIC, _VERSION, self.num_hashes, self.bit_array_size,
+                              self.capacity, self.error_rate, self.count)
+        return added
+
+    def contains_many(self, items: Iterable) -> List[bool]:
+        items = list(items)
+        if not items:
+            return []
+        return self._test(self._positions(self._hashes(items)))
+
+    def add(self, item) -> bool:
+        return self.add_many([item])[0]
+
+    def contains(self, item) -> bool:
+        return self.contains_many([item])[0]
 
-    def add(self, item):
-        for seed in range(self.num_hashes):
-            index = mmh3.hash(item, seed) % self.bit_array_size
-            self.bit_array[index] = True
+    def __contains__(self, item):
+        return self.contains(item)
 
-    def contains(self, item):
-        for seed in range(self.num_hashes):
-            index = mmh3.hash(item, seed) % self.bit_array_size
-            if not self.bit_array[index]:
-                return False
-        return True
+    def __len__(self):
+        return self.count
 
     def clear(self):
-        self.bit_array = [False] * self.bit_array_size
+        if self._bits is not None:
+            self._bits[:] = 0
+        else:
+            self.bit_array[:] = bytes(len(self.bit_array))
+        self.count = 0
+        if self._mmap is not None:
+            _HEADER.pack_into(self._mmap, 0, _MAGIC, _VERSION, self.num_hashes, self.bit_array_size,
+                              self.capacity, self.error_rate, 0)
+
+    def flush(self):
+        """将映射的位数组写回文件 (Flush the memory-mapped bits to disk)"""
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def close(self):
+        if self._mmap is None:
+            return
+        self._bits = None
+        self.bit_array.release()
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.close()
+        self._mmap = self._file = None
+
+    def stats(self) -> Dict:
+        """填充率与估计误判率 (Fill ratio and estimated false positive rate)"""
+        k, m = self.num_hashes, self.bit_array_size
+        return {
+            'items': self.count,
+            'fill': round(self.count / self.capacity, 3),
+            'fpr': float(f'{(1 - math.exp(-k * self.count / m)) ** k:.2e}'),
+            'memory_mb': round(m / 8 / 1024 / 1024, 1),
+        }
+
+
+class AsyncBloomFilter:
+    """
+    BloomFilter 的异步包装, 接口与 Redis 的 AsyncBloomFilter 相同, 未部署 Redis 时用于结果去重
+    (Async drop-in for the Redis filter when no Redis is deployed)
+    """
+
+    def __init__(self, capacity, error_rate=0.001, path: Optional[str] = None):
+        self._filter = BloomFilter(capacity, error_rate, path)
+
+    async def add(self, item) -> bool:
+        return self._filter.add(item)
+
+    async def add_if_absent(self, item) -> bool:
+        return self._filter.add(item)
+
+    async def exists(self, item) -> bool:
+        return self._filter.contains(item)
+
+    async def add_many(self, items: Iterable) -> List[bool]:
+        return self._filter.add_many(items)
+
+    async def exists_many(self, items: Iterable) -> List[bool]:
+        return self._filter.contains_many(items)
+
+    def close(self):
+        self._filter.close()
+
+    def stats(self) -> Dict:
+        return self._filter.stats()
+
 
 # 示例用法
 if __name__ == "__main__":
@@ -46,5 +239,5 @@ if __name__ == "__main__":
     print(bloom_filter.contains("apple"))  # True
     print(bloom_filter.contains("grape"))  # False (可能误判，但这里没有添加过)
 
-    # 如果元素不在布隆过滤器中，contains 方法可能会误判为存在
-    print(bloom_filter.contains("strawberry"))  # False，但可能会误判为 True
+    # 批量写入, 返回每个元素写入前是否不存在
+    print(bloom_filter.add_many(["apple", "pear", "pear"]))  # [False, True, False]
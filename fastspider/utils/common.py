@@ -1,3 +1,6 @@
+import zlib
+
+
 def num_to_base36(num: int) -> str:
     """数字转换成base32 (Convert number to base 36)"""
 
@@ -28,5 +31,10 @@ def _get_first_item_from_list(_list) -> list:
     return []
 
 
+def stable_hash(obj) -> int:
+    """跨进程稳定的哈希值, 内置 hash 对字符串加盐不能用于分片 (Process independent hash)"""
+    return zlib.crc32(repr(obj).encode('utf-8'))
+
+
 async def false_empty_afunc(*args):
     return False
@@ -10,8 +10,9 @@
 Change Log  :
 
 """
+import asyncio
 from pathlib import Path
-from typing import Union
+from typing import List, Union
 
 import importlib_resources
 
@@ -62,4 +63,30 @@ def split_filename(text: str, os_limit: dict) -> str:
         split_text = text[:split_index] + "......" + text[-split_index:]
         return split_text
     else:
-        return text
\ No newline at end of file
+        return text
+
+
+class AsyncFileList:
+    """
+    按行追加写入的本地文件, 接口与 Redis 的 AsyncNamedList 相同, 未部署 Redis 时使用
+    (Append-only line file with the AsyncNamedList interface, for deployments without Redis)
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = ensure_path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _write(self, item: str):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(item.replace('\n', ' ') + '\n')
+
+    async def append(self, item: str):
+        await asyncio.get_running_loop().run_in_executor(None, self._write, item)
+
+    async def all(self) -> List[str]:
+        if not self.path.exists():
+            return []
+        return self.path.read_text(encoding='utf-8').splitlines()
+
+    async def size(self) -> int:
+        return len(await self.all())
@@ -10,9 +10,20 @@
 Change Log  :
 
 """
+import hashlib
 import re
-from typing import Union, List
-from urllib.parse import urlparse
+from typing import Union, List, Optional
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode, quote
+
+# 默认端口, 规范化时省略 (Default ports dropped during canonicalization)
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+_UNRESERVED = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+_PERCENT_ESCAPE = re.compile(r'%([0-9a-fA-F]{2})')
+
+
+def _normalize_escape(match) -> str:
+    char = chr(int(match.group(1), 16))
+    return char if char in _UNRESERVED else f'%{match.group(1).upper()}'
 
 
 def split_set_cookie(cookie_str: str) -> str:
@@ -77,4 +88,51 @@ def get_host_and_port_from_ws(ws_url):
         port = parsed_url.port if parsed_url.port else 80  # 默认端口号为 80
         return host, port
     else:
-        raise ValueError("Invalid WebSocket URL")
\ No newline at end of file
+        raise ValueError("Invalid WebSocket URL")
+
+def canonicalize_url(url: str) -> str:
+    """
+    规范化URL: 协议与主机小写、去掉默认端口与片段、查询参数排序、统一百分号编码
+    (Canonicalize a URL so that equivalent URLs compare equal)
+
+    Args:
+        url (str): 原始URL (Raw URL)
+
+    Returns:
+        str: 规范化后的URL (Canonical URL)
+    """
+    parts = urlsplit(str(url).strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+    if parts.username:
+        userinfo = parts.username + (f':{parts.password}' if parts.password else '')
+        host = f'{userinfo}@{host}'
+    # 只解码非保留字符, %2F 等保留字符的转义保持不变
+    path = quote(_PERCENT_ESCAPE.sub(_normalize_escape, parts.path), safe="/%:@!$&'()*+,;=-._~") or '/'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ''))
+
+
+def request_fingerprint(url: str, method: str = 'GET', body: Optional[Union[str, bytes]] = None) -> int:
+    """
+    64位请求指纹, 由请求方法、规范化URL与请求体哈希决定 (64-bit fingerprint of method, canonical URL and body)
+
+    Args:
+        url (str): 请求URL (Request URL)
+        method (str): 请求方法 (Request method)
+        body (Union[str, bytes]): 请求体 (Request body)
+
+    Returns:
+        int: 非零的64位指纹 (Non-zero 64-bit fingerprint)
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(method.upper().encode('utf-8'))
+    digest.update(b' ')
+    digest.update(canonicalize_url(url).encode('utf-8'))
+    if body:
+        digest.update(b' ')
+        digest.update(hashlib.blake2b(body if isinstance(body, bytes) else body.encode('utf-8')).digest())
+    # 0 在指纹集合中表示空槽 (0 marks an empty slot in FingerprintSet)
+    return int.from_bytes(digest.digest(), 'big') or 1
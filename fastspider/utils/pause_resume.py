@@ -11,18 +11,20 @@ Change Log  :
 
 """
 import asyncio
-import threading
-from abc import ABC
-from typing import Any
+from typing import Any, Callable, Hashable
 
 import aiohttp
 
+from fastspider.core.lifecycle import TaskRegistry
+from fastspider.core.runtime import Component
+from fastspider.http.limiter import AdaptiveLimiter
+from fastspider.http.throttle import AutoThrottle
 from fastspider.utils._signal import SignalManager
+from fastspider.utils.queues import WatermarkQueue
 
 
-class AsyncPauseAbleTask(ABC, threading.Thread):
+class AsyncPauseAbleTask(Component):
     def __init__(self, cfg: dict, loop: asyncio.AbstractEventLoop = None):
-        super().__init__()
         self._cfg = cfg
         self._paused: bool = False
         self._running: bool = False
@@ -30,19 +32,39 @@ class AsyncPauseAbleTask(ABC, threading.Thread):
         self._loop = loop or asyncio.get_event_loop()
         self._pause_event = asyncio.Event()
         self._pause_event.set()
-        self._task_queue = asyncio.Queue()
-        self._semaphore = asyncio.Semaphore(cfg['thread_num'])
-        connector = aiohttp.TCPConnector(ssl=cfg['ssl'],
-                                         limit_per_host=cfg['limit_per_host'],
-                                         limit=cfg['limit'])
+        self._task_queue = WatermarkQueue.from_cfg(cfg.get('task_queue'), high=cfg['thread_num'] * 10)
+        # 并发上限可在运行中调整, 开启 concurrency.enable 后根据响应延迟与错误率自动调整
+        self._semaphore = AdaptiveLimiter(cfg)
+        self._throttle = AutoThrottle(cfg)
+        self._registry = TaskRegistry()
+        self._client = None
+
+    async def setup(self):
+        # 连接池必须在事件循环运行后创建 (The session must be created inside the running loop)
+        connector = aiohttp.TCPConnector(ssl=self._cfg['ssl'],
+                                         limit_per_host=self._cfg['limit_per_host'],
+                                         limit=self._cfg['limit'])
         self._client = aiohttp.ClientSession(connector=connector)
 
+    async def teardown(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
     def pause(self):
         self._paused = True
         self._pause_event.set()
 
     def stop(self):
+        """通知主循环退出, 可在其他线程或信号处理中调用 (Wake the loop so it exits without waiting for a task)"""
         self._running = False
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._wakeup)
+
+    def _wakeup(self):
+        # 放出等待中的主循环: 暂停等待与取任务都会立即返回, None 为结束标记
+        self._pause_event.set()
+        self._task_queue.put_nowait(None)
 
     @property
     def running(self):
@@ -52,6 +74,22 @@ class AsyncPauseAbleTask(ABC, threading.Thread):
     def status(self):
         return self._status
 
+    @property
+    def throttle(self) -> AutoThrottle:
+        return self._throttle
+
+    @property
+    def limiter(self) -> AdaptiveLimiter:
+        return self._semaphore
+
+    @property
+    def registry(self) -> TaskRegistry:
+        return self._registry
+
+    @property
+    def task_queue(self) -> WatermarkQueue:
+        return self._task_queue
+
     def set_status(self, status: int):
         self._status = status
 
@@ -65,6 +103,19 @@ class AsyncPauseAbleTask(ABC, threading.Thread):
     def remove_task(self, task_id: Any):
         raise NotImplementedError
 
+    def cancel_tasks(self, predicate: Callable[[Any], bool]) -> int:
+        """批量取消满足条件的任务, 返回取消数量 (Cancel all tasks matching `predicate`)"""
+        return self._registry.cancel_where(predicate)
+
+    def pause_task(self, key: Hashable) -> bool:
+        """暂停排队中的任务, 出队时暂不执行 (Hold a queued task until resume_task)"""
+        return self._registry.pause(key)
+
+    def resume_task(self, key: Hashable):
+        task = self._registry.resume(key)
+        if task is not None:
+            self._task_queue.put_nowait(task)
+
     async def _task_handler(self, task_queue: asyncio.Queue):
         raise NotImplementedError
 
@@ -74,8 +125,11 @@ class AsyncPauseAbleTask(ABC, threading.Thread):
                 break
             await self._pause_event.wait()
             await self._semaphore.acquire()
+            if not self._running:
+                self._semaphore.release()
+                break
             await self._task_handler(self._task_queue)
 
-    def run(self):
+    async def run(self):
         self._running = True
-        self._loop.run_until_complete(self._work())
+        await self._work()
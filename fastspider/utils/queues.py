@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+@Description: 带水位线的有界队列
+@Date       : 2024/6/25 10:32
+@Author     : lkkings
+@FileName:  : queues.py
+@Github     : https://github.com/lkkings
+@Mail       : lkkings888@gmail.com
+-------------------------------------------------
+Change Log  :
+
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+
+class WatermarkQueue(asyncio.Queue):
+    """
+    带高低水位线的有界队列 (Bounded queue with high and low watermarks)
+
+    队列长度达到高水位后 put 挂起, 直到消费者将队列消费到低水位才恢复,
+    避免生产者在临界点上反复挂起唤醒。put_nowait 不受水位限制, 供重试、结束标记等不能丢弃的数据使用。
+    high 为 0 时队列无界。
+    """
+
+    def __init__(self, high: int = 0, low: Optional[int] = None):
+        super().__init__()
+        self.high = high
+        self.low = high // 2 if low is None else min(low, high)
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self.blocked_time = 0.0
+        self.blocked_count = 0
+
+    @classmethod
+    def from_cfg(cls, cfg: Optional[Dict], high: int = 0) -> "WatermarkQueue":
+        """
+        从配置创建队列 (Create a queue from config)
+
+        Args:
+            cfg: dict: 形如 {'high': 1000, 'low': 500} 的配置
+            high: int: 未配置时的默认高水位
+        """
+        cfg = cfg or {}
+        return cls(high=cfg.get('high', high), low=cfg.get('low'))
+
+    @property
+    def blocked(self) -> bool:
+        """是否处于高水位阻塞状态, 不覆盖 full() 以免 put_nowait 抛出 QueueFull"""
+        return not self._writable.is_set()
+
+    async def put(self, item):
+        if not self._writable.is_set():
+            self.blocked_count += 1
+            start = time.monotonic()
+            try:
+                await self._writable.wait()
+            finally:
+                self.blocked_time += time.monotonic() - start
+        self.put_nowait(item)
+
+    def put_nowait(self, item):
+        super().put_nowait(item)
+        if self.high and self.qsize() >= self.high:
+            self._writable.clear()
+
+    def get_nowait(self):
+        item = super().get_nowait()
+        if not self._writable.is_set() and self.qsize() <= self.low:
+            self._writable.set()
+        return item
+
+    def stats(self) -> Dict:
+        return {
+            'depth': self.qsize(),
+            'high': self.high,
+            'blocked': round(self.blocked_time, 2),
+        }